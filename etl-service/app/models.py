@@ -51,4 +51,12 @@ class Subscription(db.Model):
     room_name = db.Column(db.String, nullable=False)  # The room or topic name
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
-    user = db.relationship('User', back_populates='subscriptions')
\ No newline at end of file
+    user = db.relationship('User', back_populates='subscriptions')
+
+
+class SyncWatermark(db.Model):
+    __tablename__ = 'sync_watermarks'
+
+    # Last id synced from each source table
+    table_name = db.Column(db.String, primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
@@ -1,144 +1,252 @@
 import requests
 from dotenv import load_dotenv
 import os
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import takewhile
+from sqlalchemy import delete, select
 
 from .. import db, scheduler
-from ..models import Job, Skill, SkillsList, User, Subscription
+from ..models import Job, Skill, SkillsList, User, Subscription, SyncWatermark
+from ..tools.bulk_loader import load_batch
 
 load_dotenv()
 USER_SERVICE_HOST = os.getenv("USER_SERVICE_HOST")
 SCRAPER_SERVICE_HOST = os.getenv("SCRAPER_SERVICE_HOST")
+EXPORT_PAGE_SIZE = 1000
+EXPORT_TIMEOUT = 30
+PIPELINE_DEPTH = 4  # pages downloaded ahead of the loader
+# Ids are handed out in insert order, not commit order, so the ids missing
+# below each watermark are read again until their row shows up. Those
+# still missing after GAP_SECONDS are taken for rolled back inserts.
+GAP_SECONDS = 300
+LOOKBACK_IDS = 1000  # the most gaps kept below a new id
+# The rows updated or deleted at the sources only reach the warehouse in a
+# full reconcile, run on start and then this often
+RECONCILE_SECONDS = int(os.getenv("RECONCILE_SECONDS", 3600))
+DELETE_CHUNK_SIZE = 1000
+
+# Tables of each source in load order: (table, model, (parent table, foreign key))
+SOURCES = {
+    USER_SERVICE_HOST: [
+        ("users", User, None),
+        ("subscriptions", Subscription, ("users", "user_id")),
+    ],
+    SCRAPER_SERVICE_HOST: [
+        ("skills_list", SkillsList, None),
+        ("jobs", Job, None),
+        ("skills", Skill, ("jobs", "job_id")),
+    ],
+}
+TABLES = {
+    table: (model, parent)
+    for tables in SOURCES.values()
+    for table, model, parent in tables
+}
+
+# One pooled keep-alive session and one extract thread per source
+sessions = {host: requests.Session() for host in SOURCES}
+executor = ThreadPoolExecutor(max_workers=len(SOURCES), thread_name_prefix="etl-extract")
+last_reconcile = None
+gaps = {}  # table -> missing id -> when it was found missing
+
+
+def export_pages(host, table, since=0):
+    """Pages of the rows of a service's table after an id, in id order"""
+    after_id = since
+    while True:
+        response = sessions[host].get(
+            host + "/get-db-data",
+            params={
+                "format": "ndjson",
+                "table": table,
+                "since": since,
+                "after_id": after_id,
+                "limit": EXPORT_PAGE_SIZE
+            },
+            stream=True,
+            timeout=EXPORT_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch {table}: {response.text}")
+
+        page = [json.loads(line) for line in response.iter_lines() if line]
+        if page:
+            yield page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after_id = page[-1]['id']
+
+
+def extract(host, since, pages, cancelled):
+    """Download the tables of a source into the pages queue, in load order"""
+    error = None
+    try:
+        for table, _, _ in SOURCES[host]:
+            for page in export_pages(host, table, since[table]):
+                if cancelled.is_set():
+                    return
+                pages.put((table, page))
+            pages.put((table, None))
+    except Exception as e:
+        error = e
+    finally:
+        # Tell the loader this source is done
+        pages.put((None, error))
+
+
+def delete_missing(table, after_id, up_to_id, exported_ids):
+    """Delete the warehouse rows of an id range the source didn't export,
+    with the rows of the child tables referencing them. Returns how many.
+    """
+    model = TABLES[table][0]
+    query = select(model.id).where(model.id > after_id)
+    if up_to_id is not None:
+        query = query.where(model.id <= up_to_id)
+    missing = [row_id for row_id in db.session.scalars(query) if row_id not in exported_ids]
+    for start in range(0, len(missing), DELETE_CHUNK_SIZE):
+        chunk = missing[start:start + DELETE_CHUNK_SIZE]
+        for child, (child_model, parent) in TABLES.items():
+            if parent and parent[0] == table:
+                db.session.execute(delete(child_model).where(getattr(child_model, parent[1]).in_(chunk)))
+        db.session.execute(delete(model).where(model.id.in_(chunk)))
+    return len(missing)
+
+
+def track_gaps(table, row_ids, last_id):
+    """Note the ids skipped below the rows past the watermark, drop the
+    ones the rows fill
+    """
+    now = time.monotonic()
+    missing = gaps.setdefault(table, {})
+    for row_id in row_ids:
+        if row_id > last_id:
+            for gap in range(max(last_id + 1, row_id - LOOKBACK_IDS), row_id):
+                missing.setdefault(gap, now)
+            last_id = row_id
+        else:
+            missing.pop(row_id, None)
+
+
+def sync(reconcile=False):
+    """Load the source rows committed since the last cycle into the
+    warehouse, the ones past the watermarks and the ones filling gaps.
+
+    A reconcile reads the whole tables instead, page by page, rewriting
+    the rows that changed and deleting the ones gone from the sources.
+    Raises the first error of a source or of the load.
+    """
+    pages = queue.Queue(maxsize=PIPELINE_DEPTH)
+    cancelled = threading.Event()
+    running = 0
+    try:
+        watermarks = {
+            watermark.table_name: watermark
+            for watermark in SyncWatermark.query.all()
+        }
+        for table in TABLES:
+            watermarks.setdefault(table, SyncWatermark(table_name=table, last_id=0))
+
+        # The gaps left open too long were rolled back
+        expired = time.monotonic() - GAP_SECONDS
+        for table in TABLES:
+            gaps[table] = {gap: found for gap, found in gaps.get(table, {}).items() if found > expired}
+
+        # All the sources download concurrently while the pages that
+        # already arrived get loaded, from the lowest gap on
+        since = {
+            table: 0 if reconcile else min(gaps[table], default=watermark.last_id + 1) - 1
+            for table, watermark in watermarks.items()
+        }
+        for host in SOURCES:
+            executor.submit(extract, host, since, pages, cancelled)
+            running += 1
+
+        stopped, reconciled_up_to = set(), dict.fromkeys(TABLES, 0)
+        while running:
+            table, page = pages.get()
+            if table is None:
+                running -= 1
+                if page is not None:
+                    raise page
+                continue
+            if table in stopped:
+                continue
+            watermark = watermarks[table]
+
+            # The source has no rows past the last page
+            if page is None:
+                if reconcile:
+                    deleted = delete_missing(table, reconciled_up_to[table], None, set())
+                    if deleted:
+                        print(f"Deleted {deleted} rows gone from {table}")
+                    db.session.commit()
+                continue
+
+            # The rows between the lowest gap and the watermark are loaded already
+            if not reconcile:
+                page = [row for row in page if row['id'] > watermark.last_id or row['id'] in gaps[table]]
+
+            # Stop at the first row whose parent was inserted after the
+            # parent table got synced, it is picked up next cycle
+            model, parent = TABLES[table]
+            rows = page
+            if parent:
+                parent_last_id = watermarks[parent[0]].last_id
+                rows = list(takewhile(
+                    lambda row: (row[parent[1]] or 0) <= parent_last_id, page
+                ))
+            if len(rows) < len(page):
+                stopped.add(table)
+            if not rows:
+                continue
+
+            # Skills list entries are matched by name as well, an
+            # existing name is never overwritten
+            load_batch(model, rows, update=model is not SkillsList)
+
+            # The page covers the ids up to its last row, the rows of
+            # the range not in it are gone
+            if reconcile:
+                deleted = delete_missing(
+                    table, reconciled_up_to[table], rows[-1]['id'], {row['id'] for row in rows}
+                )
+                if deleted:
+                    print(f"Deleted {deleted} rows gone from {table}")
+                reconciled_up_to[table] = rows[-1]['id']
+
+            # Commit each page together with the watermark
+            track_gaps(table, [row['id'] for row in rows], watermark.last_id)
+            watermark.last_id = max(watermark.last_id, rows[-1]['id'])
+            db.session.add(watermark)
+            db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    finally:
+        # Let the extract threads still running finish
+        cancelled.set()
+        while running:
+            table, _ = pages.get()
+            if table is None:
+                running -= 1
 
 
 @scheduler.task('interval', id='save_in_warehouse', seconds=5, max_instances=1)
 def save_in_warehouse():
+    global last_reconcile
     with scheduler.app.app_context():
         print("SAVING DATA IN WAREHOUSE STARTED!")
+        reconcile = last_reconcile is None or time.monotonic() - last_reconcile >= RECONCILE_SECONDS
         try:
-            # Fetch data from the User API
-            user_response = requests.get(USER_SERVICE_HOST + "/get-db-data")
-            if user_response.status_code != 200:
-                raise Exception(f"Failed to fetch users: {user_response.json().get('message')}")
-
-            user_data = user_response.json().get('data', [])
-
-            # Insert User and Subscription data
-            for user in user_data:
-                user_obj = User.query.get(user['id'])
-                if user_obj:
-                    # Check if the data has changed
-                    if (
-                        user_obj.username != user['username'] or
-                        user_obj.email != user['email'] or
-                        user_obj.password != user['password']
-                    ):
-                        db.session.delete(user_obj)  # Delete the existing record
-                        db.session.commit()  # Commit the deletion
-                        user_obj = None  # Mark for re-creation
-
-                if not user_obj:
-                    user_obj = User(
-                        id=user['id'],
-                        username=user['username'],
-                        email=user['email'],
-                        password=user['password']
-                    )
-                    db.session.add(user_obj)
-
-                # Handle subscriptions
-                for sub in user['subscriptions']:
-                    subscription_obj = Subscription.query.get(sub['id'])
-                    if subscription_obj:
-                        # Check if the data has changed
-                        if subscription_obj.room_name != sub['room_name'] or subscription_obj.user_id != user['id']:
-                            db.session.delete(subscription_obj)  # Delete the existing record
-                            db.session.commit()  # Commit the deletion
-                            subscription_obj = None  # Mark for re-creation
-
-                    if not subscription_obj:
-                        subscription_obj = Subscription(
-                            id=sub['id'],
-                            room_name=sub['room_name'],
-                            user_id=user['id']
-                        )
-                        db.session.add(subscription_obj)
-
-            # Fetch data from the Job API
-            job_response = requests.get(SCRAPER_SERVICE_HOST + "/get-db-data")
-            if job_response.status_code != 200:
-                raise Exception(f"Failed to fetch jobs: {job_response.json().get('message')}")
-
-            job_data = job_response.json().get('data', {})
-            jobs = job_data.get('jobs', [])
-            skills_list = job_data.get('skills_list', [])
-            # Insert Job and Skill data
-            for job in jobs:
-                job_obj = Job.query.get(job['id'])
-                if job_obj:
-                    # Check if the data has changed
-                    if (
-                        job_obj.title != job['title'] or
-                        job_obj.salary != job['salary'] or
-                        job_obj.currency != job['currency'] or
-                        job_obj.experience != job['experience'] or
-                        job_obj.link != job['link'] or
-                        job_obj.date != job['date']
-                    ):
-                        db.session.delete(job_obj)  # Delete the existing record
-                        db.session.commit()  # Commit the deletion
-                        job_obj = None  # Mark for re-creation
-
-                if not job_obj:
-                    job_obj = Job(
-                        id=job['id'],
-                        title=job['title'],
-                        salary=job['salary'],
-                        currency=job['currency'],
-                        experience=job['experience'],
-                        link=job['link'],
-                        date=job['date']
-                    )
-                    db.session.add(job_obj)
-
-                # Handle skills for the job
-                for skill in job['skills']:
-                    skill_obj = Skill.query.get(skill['id'])
-                    if skill_obj:
-                        # Check if the data has changed
-                        if (
-                            skill_obj.name != skill['name'] or
-                            skill_obj.job_id != job['id'] or
-                            skill_obj.counter != skill['counter']
-                        ):
-                            db.session.delete(skill_obj)  # Delete the existing record
-                            db.session.commit()  # Commit the deletion
-                            skill_obj = None  # Mark for re-creation
-
-                    if not skill_obj:
-                        skill_obj = Skill(
-                            id=skill['id'],
-                            name=skill['name'],
-                            job_id=job['id'],
-                            counter=skill['counter']
-                        )
-                        db.session.add(skill_obj)
-
-            # # Insert SkillsList data
-            for skill in skills_list:
-                skill_list_obj = SkillsList.query.filter_by(
-                    name=str(skill['name'])
-                ).first()
-                if not skill_list_obj:
-                    skill_list_obj = SkillsList(
-                        id=skill['id'],
-                        name=str(skill['name'])
-                    )
-                    db.session.add(skill_list_obj)
-
-            # Commit all changes
-            db.session.commit()
+            sync(reconcile)
+            if reconcile:
+                last_reconcile = time.monotonic()
             print("Data synchronization completed successfully.")
-
         except Exception as e:
-            db.session.rollback()
-            print(f"An error occurred during synchronization: {str(e)}")
\ No newline at end of file
+            print(f"An error occurred during synchronization: {str(e)}")
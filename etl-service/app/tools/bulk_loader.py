@@ -0,0 +1,55 @@
+import time
+from prometheus_client import Counter, Gauge
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .. import db
+
+
+ROWS_LOADED = Counter(
+    'etl_rows_loaded_total', 'Rows upserted into the warehouse', ['table']
+)
+LOAD_THROUGHPUT = Gauge(
+    'etl_load_rows_per_second', 'Upsert throughput of the last loaded batch', ['table']
+)
+
+
+def upsert_statement(model, update=True):
+    """INSERT ... ON CONFLICT for the warehouse database.
+
+    Existing rows are only rewritten when a column actually changed; with
+    update=False conflicting rows are left untouched.
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        statement = postgresql.insert(model)
+    else:
+        statement = sqlite.insert(model)
+
+    if not update:
+        return statement.on_conflict_do_nothing()
+
+    columns = [column for column in model.__table__.columns if not column.primary_key]
+    return statement.on_conflict_do_update(
+        index_elements=model.__table__.primary_key.columns,
+        set_={column.name: statement.excluded[column.name] for column in columns},
+        where=or_(*(
+            column.is_distinct_from(statement.excluded[column.name])
+            for column in columns
+        ))
+    )
+
+
+def load_batch(model, rows, update=True):
+    """Upsert a batch of rows in the current transaction, returns rows/s"""
+    if not rows:
+        return 0
+
+    start = time.perf_counter()
+    db.session.execute(upsert_statement(model, update), rows)
+    elapsed = time.perf_counter() - start
+
+    table = model.__tablename__
+    throughput = len(rows) / elapsed if elapsed > 0 else 0
+    ROWS_LOADED.labels(table).inc(len(rows))
+    LOAD_THROUGHPUT.labels(table).set(throughput)
+    return throughput
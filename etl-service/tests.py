@@ -0,0 +1,170 @@
+import pytest
+from flask import Flask
+from app import db
+from app.models import Job, Skill, SkillsList, User, Subscription, SyncWatermark
+from app.tasks import save_in_warehouse as etl
+
+
+# Helper function building the rows of a source table
+def job(id, salary=1000.0):
+    return {"id": id, "title": f"Developer {id}", "salary": salary, "currency": "mdl",
+            "experience": 1.0, "link": f"https://www.rabota.md/ro/jobs/{id}", "date": "01.01.2024"}
+
+def skill(id, job_id, name="python"):
+    return {"id": id, "name": name, "job_id": job_id, "counter": 1}
+
+# Helper fixture serving the source tables from memory, in pages of 2 rows
+@pytest.fixture
+def sources(monkeypatch):
+    tables = {table: [] for table in ("users", "subscriptions", "skills_list", "jobs", "skills")}
+    def export_pages(host, table, since=0):
+        rows = sorted((row for row in tables[table] if row["id"] > since), key=lambda row: row["id"])
+        export_pages.requests.append((table, since, len(rows)))
+        for start in range(0, len(rows), 2):
+            yield [dict(row) for row in rows[start:start + 2]]
+    export_pages.requests = []
+    monkeypatch.setattr(etl, "export_pages", export_pages)
+    monkeypatch.setattr(etl, "gaps", {})
+    monkeypatch.setattr(etl, "SOURCES", {
+        "user-service": [
+            ("users", User, None),
+            ("subscriptions", Subscription, ("users", "user_id")),
+        ],
+        "scraper-service": [
+            ("skills_list", SkillsList, None),
+            ("jobs", Job, None),
+            ("skills", Skill, ("jobs", "job_id")),
+        ],
+    })
+    monkeypatch.setattr(etl, "TABLES", {
+        table: (model, parent)
+        for tables_of_host in etl.SOURCES.values()
+        for table, model, parent in tables_of_host
+    })
+    return tables
+
+@pytest.fixture
+def warehouse():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+def watermark(table):
+    return db.session.get(SyncWatermark, table).last_id
+
+def ids(model):
+    return sorted(db.session.scalars(db.select(model.id)))
+
+def exported(table):
+    """(since, rows) of the table's exports since the last call"""
+    requests = [(since, rows) for name, since, rows in etl.export_pages.requests if name == table]
+    etl.export_pages.requests.clear()
+    return requests
+
+
+def test_sync_advances_the_watermarks(sources, warehouse):
+    sources["jobs"] += [job(1), job(2), job(3)]
+    sources["skills"] += [skill(1, 1), skill(2, 3)]
+
+    etl.sync()
+
+    assert ids(Job) == [1, 2, 3]
+    assert ids(Skill) == [1, 2]
+    assert watermark("jobs") == 3
+    assert watermark("skills") == 2
+
+    # Only the rows past the watermark are new
+    sources["jobs"].append(job(4))
+    etl.sync()
+    assert ids(Job) == [1, 2, 3, 4]
+    assert watermark("jobs") == 4
+
+def test_sync_stops_at_the_children_of_unsynced_parents(sources, warehouse):
+    sources["jobs"] += [job(1), job(2)]
+    # Skills of a job inserted after the jobs table was exported
+    sources["skills"] += [skill(1, 1), skill(2, 3), skill(3, 1)]
+
+    etl.sync()
+
+    # The rows after the first one gated are left for the next cycle
+    assert ids(Skill) == [1]
+    assert watermark("skills") == 1
+
+    sources["jobs"].append(job(3))
+    etl.sync()
+    assert ids(Job) == [1, 2, 3]
+    assert ids(Skill) == [1, 2, 3]
+    assert watermark("skills") == 3
+
+def test_sync_reads_the_rows_committed_late(sources, warehouse):
+    sources["jobs"] += [job(1), job(2), job(4)]
+    etl.sync()
+    assert watermark("jobs") == 4
+
+    # Job 3's transaction commits after job 4 was synced
+    sources["jobs"].append(job(3))
+    exported("jobs")
+    etl.sync()
+
+    assert ids(Job) == [1, 2, 3, 4]
+    assert watermark("jobs") == 4
+    assert exported("jobs") == [(2, 2)]
+
+    # Nothing is left to read again
+    etl.sync()
+    assert exported("jobs") == [(4, 0)]
+
+def test_sync_gives_up_on_gaps_rolled_back(sources, warehouse, monkeypatch):
+    sources["jobs"] += [job(1), job(3)]
+    etl.sync()
+    etl.sync()
+    assert exported("jobs")[-1] == (1, 1)
+
+    monkeypatch.setattr(etl, "GAP_SECONDS", 0)
+    etl.sync()
+    assert exported("jobs") == [(3, 0)]
+
+def test_idle_sync_transfers_nothing(sources, warehouse):
+    sources["users"] += [{"id": id, "username": f"user{id}", "email": f"user{id}@example.com",
+                          "password": f"hash{id}"} for id in range(1, 6)]
+    sources["jobs"] += [job(id) for id in range(1, 6)]
+    etl.sync()
+    exported("users")
+
+    etl.sync()
+    assert [rows for _, _, rows in etl.export_pages.requests] == [0] * len(etl.TABLES)
+
+def test_reconcile_applies_the_updates_and_deletes(sources, warehouse):
+    sources["jobs"] += [job(1), job(2), job(3), job(4), job(5)]
+    sources["skills"] += [skill(1, 1), skill(2, 2), skill(3, 3), skill(4, 5)]
+    etl.sync()
+
+    # Job 5 is gone past the last page, with its skill
+    sources["jobs"] = [job(1, salary=2000.0), job(3), job(4)]
+    sources["skills"] = [skill(1, 1, name="django"), skill(3, 3)]
+
+    # The deletes don't show up in the incremental sync
+    etl.sync()
+    assert ids(Job) == [1, 2, 3, 4, 5]
+
+    etl.sync(reconcile=True)
+    assert ids(Job) == [1, 3, 4]
+    assert ids(Skill) == [1, 3]
+    assert db.session.get(Job, 1).salary == 2000.0
+    assert db.session.get(Skill, 1).name == "django"
+
+def test_reconcile_keeps_the_rows_past_a_gated_child(sources, warehouse):
+    sources["jobs"] += [job(1), job(2)]
+    sources["skills"] += [skill(1, 1), skill(2, 2), skill(4, 1)]
+    etl.sync()
+
+    # Skill 3 of a job not synced yet stops the skills before skill 4 is read
+    sources["skills"].insert(2, skill(3, 3))
+    etl.sync(reconcile=True)
+
+    assert ids(Skill) == [1, 2, 4]
@@ -1,5 +1,6 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from dotenv import load_dotenv
 import os
 from flask_cors import CORS
@@ -26,7 +27,9 @@ redis_client = redis.StrictRedis(
     decode_responses=True  # Decodes responses to strings (instead of bytes)
 )
 try:
-    redis_client.flushall()
+    # Drop the cached insights only, the redis server is shared
+    for key in redis_client.scan_iter("insights:*"):
+        redis_client.delete(key)
 except: pass
 
 def create_app():
@@ -56,6 +59,7 @@ def create_app():
     # Create the dbs and add initial tables values
     from .models import SkillsList, Skill, Job
     with app.app_context():
+        new_database = not inspect(db.engine).has_table(Job.__tablename__)
         db.create_all()
         from .tools import rabota_md_scraper
         it_skills = [
@@ -209,6 +213,15 @@ def create_app():
                 db.session.add(SkillsList(name=str(skill)))
                 db.session.commit()
 
+        # Bring the existing tables up to the models
+        from .migrations import migrate
+        migrate(new_database)
+
+        # The seen links of an emptied database are not saved anymore
+        from .tools.seen_links import seen_links
+        if not Job.query.first():
+            seen_links.clear()
+
     # Start scheduler
     scheduler.init_app(app)
     from .tasks.scrape_jobs_from_rabota_md import scrape_jobs_from_rabota_md
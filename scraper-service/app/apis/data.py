@@ -1,15 +1,30 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from sqlalchemy import select, func, case, and_
+from sqlalchemy.orm import selectinload
 import json
 import time
-from fuzzywuzzy import fuzz
+import demjson3
+import numpy as np
 
-from .. import db, redis_client
-from ..models import Skill, Job, SkillsList
+from .. import db
+from ..models import Skill, Job, SkillsList, SkillDemand
+from ..tools.title_index import title_index, match_memo
+from ..tools.job_snapshot import job_snapshot, currency_rates
+from ..tools.insights_cache import cached_insight
+from ..tools.job_store import format_date
 
 
 data = Blueprint("data", __name__)
 REQUEST_TIMEOUT = 5
+TO_MDL = currency_rates({"mdl": 1, "usd": 17.66, "euro": 19.33})
+TO_MDL_BY_EXPERIENCE = currency_rates({"mdl": 1, "usd": 17.56, "euro": 19.28})
+EXPORT_PAGE_SIZE, EXPORT_MAX_PAGE_SIZE = 1000, 10000
+EXPORT_TABLES = {
+    "jobs": Job,
+    "skills": Skill,
+    "skills_list": SkillsList,
+}
+
 
 @data.before_request
 def start_timer():
@@ -27,15 +42,43 @@ def check_timeout(response):
     return response
 
 
+def average_salary_in_mdl(jobs, mask, rates):
+    """Average salary of the masked jobs, jobs in other currencies count as 0"""
+    mask = mask & ~np.isnan(jobs.salary)
+    salary_count = int(mask.sum())
+    total_salary = float(np.sum(jobs.salary[mask] * rates[jobs.currency[mask]]))
+    average_salary = total_salary / salary_count if salary_count > 0 else 0
+    return average_salary, salary_count
+
+
+def export_rows(model, since, after_id, limit):
+    """NDJSON lines of the table rows after an id, read with a server-side cursor"""
+    result = db.session.execute(
+        select(*model.__table__.columns)
+        .where(model.id > max(since, after_id))
+        .order_by(model.id)
+        .limit(limit)
+        .execution_options(yield_per=500)
+    )
+    for row in result:
+        yield json.dumps(dict(row._mapping), default=format_date) + "\n"
+
+
 @data.route('/find-jobs', methods=['GET'])
+@cached_insight('title')
 def find_jobs():
     title = request.args.get('title')
-    jobs = Job.query.all()
-    similar_jobs = []
-    for job in jobs:
-        ratio = fuzz.token_set_ratio(title, job.title)
-        if ratio >= 80:
-            similar_jobs.append(job)
+
+    # Only the jobs the title index can't rule out are fuzzy scored
+    title_index.sync()
+    job_ids = match_memo.matching_jobs(title, 80)
+    similar_jobs = (
+        Job.query
+        .options(selectinload(Job.skills))
+        .filter(Job.id.in_(job_ids))
+        .order_by(Job.id)
+        .all()
+    )
 
     # Prepare the response data
     jobs_data = [
@@ -46,95 +89,87 @@ def find_jobs():
             'currency': job.currency,
             'experience': job.experience,
             'link': job.link,
-            'date': job.date,
+            'date': format_date(job.date),
             'skills': [skill.name for skill in job.skills]
         }
         for job in similar_jobs
     ]
 
     return jsonify({
-        'total_jobs': len(jobs),
+        'total_jobs': len(title_index),
         'jobs': jobs_data
     })
 
 
 @data.route('/generate-insight-skills-by-demand/<string:keywords>', methods=['GET'])
+@cached_insight('keywords')
 def generate_insight_skills_by_demand(keywords):
-    jobs = Job.query.all()
-    similar_jobs = []
-    for job in jobs:
-        ratio = fuzz.token_set_ratio(keywords, job.title)
-        if ratio >= 85:
-            similar_jobs.append(job)
-    
+    title_index.sync()
+    job_ids = match_memo.matching_jobs(keywords, 85)
+
     # Get all related skills for those jobs
+    skills = (
+        db.session.query(Skill.name, Skill.counter)
+        .filter(Skill.job_id.in_(job_ids))
+        .order_by(Skill.job_id, Skill.id)
+    )
     skill_counts = {}
-    for job in similar_jobs:
-        for skill in job.skills:
-            if skill.name in skill_counts:
-                skill_counts[skill.name] += skill.counter
-            else:
-                skill_counts[skill.name] = skill.counter
+    for skill in skills:
+        if skill.name in skill_counts:
+            skill_counts[skill.name] += skill.counter
+        else:
+            skill_counts[skill.name] = skill.counter
 
     # Sort the skills by demand (counter) in descending order
     sorted_skills = sorted(skill_counts.items(), key=lambda x: x[1], reverse=True)
     
     return jsonify({
         'skills_by_demand': sorted_skills,
-        'total_jobs': len(similar_jobs)
+        'total_jobs': len(job_ids)
     })
 
 
 @data.route('/all-skills-by-demand', methods=['GET'])
+@cached_insight()
 def all_skills_by_demand():
     try:
-        if redis_client.exists("skills_data2"):
-            skills_data = json.loads(redis_client.get("skills_data2"))
-            return jsonify(skills_data), 200
-
-        # Query skills, grouping by name and summing the counter
+        # The demand of each skill is counted as the jobs are saved
         skills = (
-            db.session.query(
-                Skill.name,
-                func.count(Skill.name).label('total_demand')
-            )
-            .group_by(Skill.name)
-            .order_by(func.count(Skill.name).desc())
+            db.session.query(SkillsList.name, SkillDemand.demand.label('total_demand'))
+            .join(SkillDemand, SkillDemand.skill_id == SkillsList.id)
+            .filter(SkillDemand.demand > 0)
+            .order_by(SkillDemand.demand.desc())
             .all()
         )
 
         # Prepare the response data
         skills_data = [
             {
-                'name': skill.name,
+                'name': demjson3.decode(skill.name)[0],
                 'demand': skill.total_demand
             } for skill in skills
         ]
-        redis_client.set("skills_data2", json.dumps(skills_data), ex=500)
         return jsonify(skills_data), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @data.route('/generate-insight-average-experience/<string:keywords>', methods=['GET'])
+@cached_insight('keywords')
 def generate_insight_average_experience(keywords):
-    print("wtfsdsdsdds")
-    jobs = Job.query.all()
-    jobs_with_keyword = []
-    for job in jobs:
-        ratio = fuzz.token_set_ratio(keywords, job.title)
-        if ratio >= 85:
-            jobs_with_keyword.append(job)
-
-    if jobs_with_keyword:
-        total_experience = sum(job.experience for job in jobs_with_keyword)
-        average_experience = total_experience / len(jobs_with_keyword)
+    title_index.sync()
+    jobs = job_snapshot.sync()
+    with_keyword = np.isin(jobs.ids, match_memo.matching_jobs(keywords, 85), assume_unique=True)
+
+    jobs_num = int(with_keyword.sum())
+    if jobs_num:
+        average_experience = float(np.nansum(jobs.experience[with_keyword])) / jobs_num
     else:
         average_experience = 0
     
     return jsonify({
         'average_experience': average_experience,
-        'total_jobs': len(jobs_with_keyword)
+        'total_jobs': jobs_num
     })
 
 
@@ -145,61 +180,40 @@ def status():
 
 @data.route('/skills-by-salary', methods=['GET'])
 def list_skills_by_salary():
-    # Query the database to get all jobs with their associated skills
-    jobs = Job.query.all()
-    
-    # Dictionary to hold skills and their corresponding salaries
-    skills_salary = {}
-
-    # Populate the dictionary with skills and their associated job salaries
-    for job in jobs:
-        if job.salary is not None:
-            # Normalize currency to lowercase for consistency
-            currency = job.currency.lower()
-            for skill in job.skills:
-                if skill.name not in skills_salary:
-                    skills_salary[skill.name] = {"usd": [], "mdl": [], "euro": []}
-                if currency in skills_salary[skill.name]:
-                    skills_salary[skill.name][currency].append(job.salary)
-
-    # Create a response list to contain average salary for each skill
-    result = []
-    for skill, salaries in skills_salary.items():
-        mdl_avg = sum(salaries["mdl"]) / len(salaries["mdl"]) if salaries["mdl"] else 0
-        usd_avg = sum(salaries["usd"]) / len(salaries["usd"]) if salaries["usd"] else 0
-        euro_avg = sum(salaries["euro"]) / len(salaries["euro"]) if salaries["euro"] else 0
-
-        jobs_num = len(salaries["euro"]) + len(salaries["usd"]) + len(salaries["mdl"])
-        if len(salaries["euro"]) >= 10 and len(salaries["usd"]) >= 10 and len(salaries["mdl"]) >= 10:
-            result.append({
-                "skill": skill,
-                "avg": (euro_avg + usd_avg * 0.91 + mdl_avg * 0.052) / 3,
-                "jobs": jobs_num
-            })
-
-    # Sort skills by general coefficient in descending order
-    result.sort(key=lambda x: x['avg'], reverse=True)
+    # Average salary and number of jobs per skill and currency
+    averages, counts = {}, {}
+    for name in ("usd", "mdl", "euro"):
+        averages[name] = func.avg(case((Job.currency == name, Job.salary)))
+        counts[name] = func.count(case((Job.currency == name, 1)))
+    avg = (averages["euro"] + averages["usd"] * 0.91 + averages["mdl"] * 0.052) / 3
+
+    # Only skills with at least 10 jobs in every currency
+    skills = (
+        db.session.query(
+            Skill.name,
+            avg.label('avg'),
+            (counts["usd"] + counts["mdl"] + counts["euro"]).label('jobs')
+        )
+        .join(Job, Skill.job_id == Job.id)
+        .filter(Job.salary.isnot(None), Job.currency.in_(counts))
+        .group_by(Skill.name)
+        .having(and_(*(count >= 10 for count in counts.values())))
+        .order_by(avg.desc())
+        .all()
+    )
 
-    return jsonify(result)
+    return jsonify([
+        {"skill": skill.name, "avg": skill.avg, "jobs": skill.jobs}
+        for skill in skills
+    ])
 
 
 @data.route('/average-job-salary', methods=['GET'])
 def average_job_salary():
-    jobs = Job.query.all()
-
-    total_salary, salary_count = 0, 0
-    for job in jobs:
-        if job.salary is not None:
-            if job.currency == "usd":
-                total_salary += job.salary * 17.66
-            elif job.currency == "euro":
-                total_salary += job.salary * 19.33
-            elif job.currency == "mdl":
-                total_salary += job.salary
-            salary_count += 1
-
-    # Calculate average salary
-    average_salary = total_salary / salary_count if salary_count > 0 else 0
+    jobs = job_snapshot.sync()
+    average_salary, salary_count = average_salary_in_mdl(
+        jobs, np.ones(len(jobs), dtype=bool), TO_MDL
+    )
 
     return jsonify({
         'average_salary': average_salary,
@@ -210,25 +224,13 @@ def average_job_salary():
 @data.route('/average-job-salary-by-experience', methods=['GET'])
 def average_job_salary_by_experience():
     experience = float(request.args.get("experience"))
-    jobs = Job.query.all()
-    
-    total_salary = 0
-    salary_count = 0
-
-    for job in jobs:
-        if job.salary is not None \
-            and job.experience <= experience + 0.25 \
-            and job.experience >= experience - 0.25:
-            if job.currency == "mdl":
-                total_salary += job.salary
-            elif job.currency == "euro":
-                total_salary += job.salary * 19.28
-            elif job.currency == "usd":
-                total_salary += job.salary * 17.56
-            salary_count += 1
-
-    # Calculate average salary
-    average_salary = total_salary / salary_count if salary_count > 0 else 0
+    jobs = job_snapshot.sync()
+
+    in_range = (jobs.experience <= experience + 0.25) \
+        & (jobs.experience >= experience - 0.25)
+    average_salary, salary_count = average_salary_in_mdl(
+        jobs, in_range, TO_MDL_BY_EXPERIENCE
+    )
 
     return jsonify({
         'average_salary': average_salary,
@@ -237,21 +239,12 @@ def average_job_salary_by_experience():
 
 
 @data.route('/avg-salary/<string:keywords>', methods=['GET'])
+@cached_insight('keywords')
 def avg_salary_by_keywords(keywords):
-    jobs = Job.query.all()
-    total_salary, salary_count = 0, 0
-    for job in jobs:
-        ratio = fuzz.token_set_ratio(keywords, job.title)
-        if ratio >= 85:
-            if job.salary is not None:
-                if job.currency == "usd":
-                    total_salary += job.salary * 17.66
-                elif job.currency == "euro":
-                    total_salary += job.salary * 19.33
-                elif job.currency == "mdl":
-                    total_salary += job.salary
-                salary_count += 1
-    average_salary = total_salary / salary_count if salary_count > 0 else 0
+    title_index.sync()
+    jobs = job_snapshot.sync()
+    matching = np.isin(jobs.ids, match_memo.matching_jobs(keywords, 85), assume_unique=True)
+    average_salary, salary_count = average_salary_in_mdl(jobs, matching, TO_MDL)
     return jsonify({
         'average_salary': average_salary,
         'jobs_num': salary_count
@@ -260,9 +253,26 @@ def avg_salary_by_keywords(keywords):
 
 @data.route('/get-db-data', methods=['GET'])
 def get_db_data():
+    # Streaming mode: one table page by page, keyed by id, optionally only
+    # the rows changed since a watermark
+    if request.args.get('format') == 'ndjson':
+        model = EXPORT_TABLES.get(request.args.get('table', 'jobs'))
+        if model is None:
+            return jsonify({'status': 'error', 'message': 'Unknown table'}), 400
+        since = request.args.get('since', 0, type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = min(request.args.get('limit', EXPORT_PAGE_SIZE, type=int), EXPORT_MAX_PAGE_SIZE)
+        if limit < 1:
+            return jsonify({'status': 'error', 'message': 'The limit must be at least 1'}), 400
+        return Response(
+            stream_with_context(export_rows(model, since, after_id, limit)),
+            mimetype='application/x-ndjson'
+        )
+
     try:
-        # Query all jobs and their related skills
-        jobs = Job.query.all()
+        # Query all jobs and their related skills, the skills of all the jobs
+        # are loaded with a single extra SELECT
+        jobs = Job.query.options(selectinload(Job.skills)).all()
         skills_list = SkillsList.query.all()
 
         # Format jobs data into a list of dictionaries
@@ -275,7 +285,7 @@ def get_db_data():
                 'currency': job.currency,
                 'experience': job.experience,
                 'link': job.link,
-                'date': job.date,
+                'date': format_date(job.date),
                 'skills': [
                     {'id': skill.id, 'name': skill.name, 'counter': skill.counter}
                     for skill in job.skills
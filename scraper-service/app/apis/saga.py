@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
+import redis
 import time
 
 from ..models import SkillsList
 from .. import db
+from ..tools.insights_cache import bump_data_version
+from ..tools.job_store import link_skill
+from ..tools.skill_matcher import skill_matcher
 
 
 saga = Blueprint("saga", __name__)
@@ -18,7 +22,14 @@ def add_skill_to_list():
         db.session.add(skill)
         db.session.flush()
         skill_id = skill.id
+        # The jobs saved with the skill before it was last deleted
+        link_skill(skill_id, request.json.get("skill_name"))
         db.session.commit()
+        skill_matcher.invalidate()
+        try:
+            bump_data_version()
+        except redis.RedisError as e:
+            print(f"Could not invalidate the cached insights: {e}")
 
         # Assume error
         if not skill:
@@ -37,5 +48,10 @@ def delete_skill_from_list(skill_id):
     if skill:
         db.session.delete(skill)
         db.session.commit()
+        skill_matcher.invalidate()
+        try:
+            bump_data_version()
+        except redis.RedisError as e:
+            print(f"Could not invalidate the cached insights: {e}")
 
     return jsonify({"msg": "Transaction undone successfully!"}), 200
\ No newline at end of file
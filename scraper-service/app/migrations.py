@@ -0,0 +1,140 @@
+from sqlalchemy import Enum, bindparam, delete, distinct, func, insert, inspect, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .models import Job, Skill, SkillDemand, SchemaMigration
+from .tools.job_store import normalize_currency, parse_date
+from .tools.skill_matcher import skill_matcher
+
+
+def column_names(table):
+    return {column["name"] for column in inspect(db.session.connection()).get_columns(table)}
+
+
+def retype_column(column, convert):
+    """Replace a column of text by one of the type its model declares,
+    backfilled with convert() of each distinct value.
+
+    The values convert() gives None for are kept in the unconverted_values
+    table, by table, column and row id, before the text column is dropped.
+    """
+    table, name = column.table.name, column.name
+    typed = name + "_typed"
+    if isinstance(column.type, Enum):
+        column.type.create(db.session.connection(), checkfirst=True)  # a type of its own in postgres
+    column_type = column.type.compile(dialect=db.session.get_bind().dialect)
+    db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {typed} {column_type}'))
+
+    values = db.session.scalars(text(f'SELECT DISTINCT "{name}" FROM {table} WHERE "{name}" IS NOT NULL')).all()
+    converted = [{"old": value, "new": convert(value)} for value in values]
+    converted = [row for row in converted if row["new"] is not None]
+    if converted:
+        db.session.execute(
+            text(f'UPDATE {table} SET {typed} = :new WHERE "{name}" = :old')
+            .bindparams(bindparam("new", type_=column.type)),
+            converted
+        )
+
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS unconverted_values "
+        "(table_name VARCHAR NOT NULL, column_name VARCHAR NOT NULL, row_id INTEGER NOT NULL, value VARCHAR)"
+    ))
+    kept = db.session.execute(
+        text(
+            f'INSERT INTO unconverted_values (table_name, column_name, row_id, value) '
+            f'SELECT :table, :column, id, "{name}" FROM {table} '
+            f'WHERE "{name}" IS NOT NULL AND {typed} IS NULL'
+        ),
+        {"table": table, "column": name}
+    ).rowcount
+    if kept:
+        print(f"{kept} {table}.{name} values could not be converted, kept in unconverted_values")
+
+    db.session.execute(text(f'ALTER TABLE {table} DROP COLUMN "{name}"'))
+    db.session.execute(text(f'ALTER TABLE {table} RENAME COLUMN {typed} TO "{name}"'))
+
+
+def normalize_skills():
+    """Reference the skills list entry of every skill row and count the
+    jobs of each skill in the demand table.
+    """
+    if "skill_id" not in column_names("skills"):
+        db.session.execute(text(
+            "ALTER TABLE skills ADD COLUMN skill_id INTEGER "
+            "REFERENCES skills_list (id) ON DELETE SET NULL"
+        ))
+
+    skill_matcher.refresh()
+    skills = Skill.__table__
+    ids = [
+        {"skill_name": name, "list_id": skill_matcher.skill_id(name)}
+        for name in db.session.scalars(select(distinct(Skill.name)))
+        if skill_matcher.skill_id(name) is not None
+    ]
+    if ids:
+        db.session.execute(
+            update(skills)
+            .where(skills.c.name == bindparam("skill_name"), skills.c.skill_id.is_(None))
+            .values(skill_id=bindparam("list_id")),
+            ids
+        )
+
+    db.session.execute(delete(SkillDemand))
+    db.session.execute(insert(SkillDemand).from_select(
+        ["skill_id", "demand"],
+        select(Skill.skill_id, func.count())
+        .where(Skill.skill_id.isnot(None))
+        .group_by(Skill.skill_id)
+    ))
+
+
+def type_job_columns():
+    """Dates as dates and currencies as one of the currencies, the values
+    that aren't one become NULL.
+    """
+    retype_column(Job.__table__.c.date, parse_date)
+    retype_column(Job.__table__.c.currency, normalize_currency)
+
+
+def index_job_columns():
+    """The indexes the models declare, on the columns the endpoints filter,
+    join and group the jobs and skills by.
+    """
+    connection = db.session.connection()
+    for table in (Job.__table__, Skill.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# Schema changes db.create_all() doesn't make to existing tables, with
+# the backfills of the rows already there, in the order to apply them
+MIGRATIONS = [
+    (1, normalize_skills),
+    (2, type_job_columns),
+    (3, index_job_columns),
+]
+
+
+def migrate(new_database=False):
+    """Apply the migrations the database hasn't had yet, each in one
+    transaction recording its version. The replicas start at the same
+    time, the ones losing the race to apply a migration roll it back.
+
+    A new database is created from the models with every change made,
+    the migrations are only recorded.
+    """
+    applied = set(db.session.scalars(select(SchemaMigration.version)))
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            if not new_database:
+                migration()
+            db.session.add(SchemaMigration(version=version))
+            db.session.commit()
+            action = "Recorded" if new_database else "Applied"
+            print(f"{action} migration {version}: {migration.__name__}")
+        except SQLAlchemyError:
+            db.session.rollback()
+            if db.session.get(SchemaMigration, version) is None:
+                raise
@@ -1,16 +1,19 @@
 from . import db
 
 
+CURRENCIES = ("mdl", "usd", "euro")
+
+
 class Job(db.Model):
     __tablename__ = 'jobs'
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
     salary = db.Column(db.Float)
-    currency = db.Column(db.String)
+    currency = db.Column(db.Enum(*CURRENCIES, name='currency', create_constraint=True))
     experience = db.Column(db.Float)
     link = db.Column(db.String, unique=True)
-    date = db.Column(db.String)
+    date = db.Column(db.Date)
 
     skills = db.relationship('Skill', back_populates='job')
 
@@ -19,8 +22,9 @@ class Skill(db.Model):
     __tablename__ = 'skills'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'))
+    name = db.Column(db.String, index=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skills_list.id', ondelete='SET NULL'))
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), index=True)
     counter = db.Column(db.Integer)
 
     job = db.relationship('Job', back_populates='skills')
@@ -30,4 +34,18 @@ class SkillsList(db.Model):
     __tablename__ = "skills_list"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, nullable=False, unique=True)
\ No newline at end of file
+    name = db.Column(db.String, nullable=False, unique=True)
+
+
+class SkillDemand(db.Model):
+    __tablename__ = "skill_demand"
+
+    # Number of jobs mentioning each skill, kept up to date by save_jobs
+    skill_id = db.Column(db.Integer, db.ForeignKey('skills_list.id', ondelete='CASCADE'), primary_key=True)
+    demand = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+
+    version = db.Column(db.Integer, primary_key=True)
@@ -1,93 +1,151 @@
-import requests
 from dotenv import load_dotenv
 import os
+import time
+import redis
 
-from .. import db, scheduler
-from ..models import Skill, Job
+from .. import scheduler
+from ..tools.broadcast_dispatcher import broadcast_dispatcher
+from ..tools.crawl_queue import (
+    CrawlQueue, LocalCrawl, CRAWL_PAGES_FETCHED, CRAWL_PAGES_SKIPPED,
+    CRAWL_RUN_PAGES_FETCHED, CRAWL_RUN_PAGES_SKIPPED
+)
+from ..tools.job_store import save_jobs
+from ..tools.page_fetcher import PageFetcher
 from ..tools.rabota_md_scraper import RabotaMdScraper
+from ..tools.response_cache import ResponseCache
+from ..tools.seen_links import seen_links
+from ..tools.skill_matcher import skill_matcher
+from ..tools.title_index import title_index
+from ..tools.insights_cache import bump_data_version
 
 
 load_dotenv()
-SERVICE_DISCOVERY = os.getenv("SERVICE_DISCOVERY")
-scraper = RabotaMdScraper()
+# "coordinated" splits the pages between the replicas through redis,
+# "local" has each replica walk all of them
+CRAWL_MODE = os.getenv("CRAWL_MODE", "coordinated")
+# Incremental runs stop after this many pages in a row without new links,
+# 0 makes every run a full sweep
+CRAWL_STOP_AFTER = int(os.getenv("CRAWL_STOP_AFTER", 3))
+# Runs walk every page again once this long since the last full one
+FULL_SWEEP_SECONDS = int(os.getenv("FULL_SWEEP_SECONDS", 7 * 24 * 3600))
+# The fetched pages kept to request them conditionally next time
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+SCRAPE_INTERVAL = 20000
 
+LISTING_URL = "https://www.rabota.md/ro/vacancies/category/it/"
+FIRST_PAGE, LAST_PAGE = 2, 100
+PAGES = range(FIRST_PAGE, LAST_PAGE + 1)
 
-def get_service_details(service_name):
-    url = f'{SERVICE_DISCOVERY}/get-service?name={service_name}'
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print("Service not found." if response.status_code == 404 else f"Error: {response.status_code}")
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
+scraper = RabotaMdScraper(PageFetcher(cache=ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES)))
+# Replicas whose task fires within half an interval of the first join its run
+crawl_queue = CrawlQueue("rabota_md", run_seconds=SCRAPE_INTERVAL // 2)
+last_full_sweep = None
 
 
-@scheduler.task('interval', id='scrape_jobs_from_rabota_md', seconds=20000, max_instances=3)
+def scrape_listing_page(page, skip_unchanged=False):
+    """Scrape and save the page's new jobs, how many new links it had"""
+    data_list = []
+    # Pick up the skills added to the list by other instances
+    skill_matcher.refresh()
+    # A listing page unchanged since the last run has no new links
+    jobs_pages_links, listing = scraper.extract_listing_links(LISTING_URL + str(page), skip_unchanged)
+    print("jobs_pages_links", jobs_pages_links)
+    # Skip the ones already saved, the new ones are fetched concurrently
+    new_links = seen_links.new_links(jobs_pages_links)
+    for data in scraper.scrape_pages_data(new_links):
+        print("data", data)
+        data_list.append(data)
+
+    # Save data
+    saved = save_jobs(data_list)
+    seen_links.mark_seen([data_dict["link"] for data_dict in saved])
+
+    # Send the jobs to the users in the background
+    broadcast_dispatcher.submit(saved)
+
+    # The page is only cached once all its new jobs are saved, so the
+    # ones that failed are fetched again next run
+    if len(saved) == len(new_links):
+        scraper.fetcher.cache_page(listing)
+
+    # Make the page's new jobs searchable and invalidate the insights
+    # computed without them
+    if saved:
+        title_index.sync()
+        try:
+            bump_data_version()
+        except redis.RedisError as e:
+            print(f"Could not invalidate the cached insights: {e}")
+    return len(new_links)
+
+
+def crawl_run():
+    """This replica's part of the current run"""
+    if CRAWL_MODE == "coordinated":
+        try:
+            if crawl_queue.start(PAGES, FULL_SWEEP_SECONDS):
+                print("RabotaMdScraper queued a new crawl run")
+            return crawl_queue
+        except redis.RedisError as e:
+            print(f"Crawl queue unavailable, scraping the pages locally: {e}")
+    return local_run(PAGES)
+
+
+def local_run(pages, full_sweep=None):
+    """The pages walked by this replica alone, a full sweep if it's time
+    for one unless told
+    """
+    global last_full_sweep
+    if full_sweep is None:
+        full_sweep = last_full_sweep is None or time.monotonic() - last_full_sweep >= FULL_SWEEP_SECONDS
+    if full_sweep:
+        last_full_sweep = time.monotonic()
+    return LocalCrawl(pages, full_sweep)
+
+
+def crawl(run, stop_after):
+    """Scrape the run's pages, those after a streak of stop_after pages
+    without new links are skipped unless it's a full sweep. Full sweeps
+    also parse the listing pages unchanged since they were cached.
+
+    If the shared queue fails midway, the pages this replica hasn't
+    scraped yet are walked locally.
+    """
+    fetched = skipped = 0
+    scraped = set()
+    incremental = None
+    while True:
+        try:
+            if incremental is None:
+                incremental = stop_after > 0 and not run.full_sweep
+            for page in run.pages():
+                new_links = scrape_listing_page(page, skip_unchanged=incremental)
+                scraped.add(page)
+                fetched += 1
+                if incremental:
+                    run.record(page, new_links)
+                    if not new_links and run.stale_streak(page, stop_after):
+                        skipped += run.stop()
+            break
+        except redis.RedisError as e:
+            if isinstance(run, LocalCrawl):
+                raise
+            print(f"Crawl queue failed, finishing the run locally: {e}")
+            full_sweep = None if incremental is None else not incremental
+            run = local_run([page for page in PAGES if page not in scraped], full_sweep)
+            incremental = stop_after > 0 and not run.full_sweep
+
+    CRAWL_PAGES_FETCHED.inc(fetched)
+    CRAWL_PAGES_SKIPPED.inc(skipped)
+    CRAWL_RUN_PAGES_FETCHED.set(fetched)
+    CRAWL_RUN_PAGES_SKIPPED.set(skipped)
+    return fetched, skipped
+
+
+@scheduler.task('interval', id='scrape_jobs_from_rabota_md', seconds=SCRAPE_INTERVAL, max_instances=3)
 def scrape_jobs_from_rabota_md():
     print("RabotaMdScraper started scraping!")
     with scheduler.app.app_context():
-        # Extract data
-        page, max_page = 2, 100
-        url = "https://www.rabota.md/ro/vacancies/category/it/"
-        while page <= max_page:
-            data_list = []
-            jobs_pages_links = scraper.extract_page_links(url + str(page))
-            print("jobs_pages_links", jobs_pages_links)
-            for link in jobs_pages_links:
-                # Check if it already exists
-                job = Job.query.filter_by(link=link).first()
-                if job: continue
-                data = scraper.scrape_page_data(link)
-                print("data", data)
-                data_list.append(data)
-                print("\n"*5)
-                print(data)
-            page += 1
-
-            # Save data
-            for data_dict in data_list:
-                print("data_dict", data_dict)
-                try:
-                    # Create a new job record
-                    new_job = Job(
-                        title=data_dict.get("title"), 
-                        salary=data_dict.get("salary"), 
-                        currency=data_dict.get("currency"),
-                        experience=data_dict.get("experience"), 
-                        link=data_dict.get("link"), 
-                        date=data_dict.get("date")
-                    )
-                    db.session.add(new_job)
-                    db.session.commit()
-
-                    # Add skills
-                    skills = data_dict.get("skills")
-                    if skills:
-                        for skill, counter in skills.items():
-                            new_skill_record = Skill(
-                                job_id=new_job.id,
-                                name=skill,
-                                counter=counter
-                            )
-                            db.session.add(new_skill_record)
-
-                    # Add the job to the session
-                    db.session.commit()
-
-                    # Send the job to the user
-                    try:
-                        user_services = get_service_details("user-service")
-                        print("user_services", user_services, "-----------------")
-                        for user_service in user_services:
-                            url_user = f"{user_service["serviceAddress"]}:{user_service["servicePort"]}/broadcast-jobs-to-users"
-                            print(url_user)
-                            response = requests.post(url=url_user, json=data_dict)
-                            print(response.status_code)
-                    except Exception as e:
-                        print(str(e))
-                except Exception as e:
-                    print(str(e))
-                    db.session.rollback()
-        print("RabotaMdScraper finished scraping!")
\ No newline at end of file
+        fetched, skipped = crawl(crawl_run(), CRAWL_STOP_AFTER)
+        print(f"RabotaMdScraper finished scraping! {fetched} pages fetched, {skipped} skipped")
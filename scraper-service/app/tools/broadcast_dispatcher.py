@@ -0,0 +1,132 @@
+from dotenv import load_dotenv
+from prometheus_client import Counter as MetricCounter
+import os
+import queue
+import threading
+import time
+import requests
+
+
+load_dotenv()
+SERVICE_DISCOVERY = os.getenv("SERVICE_DISCOVERY")
+
+BROADCAST_JOBS_SENT = MetricCounter(
+    'broadcast_jobs_sent_total', 'Jobs delivered to the user service'
+)
+BROADCAST_JOBS_DROPPED = MetricCounter(
+    'broadcast_jobs_dropped_total', 'Jobs given up on after the retries or a full queue'
+)
+
+
+def get_service_details(service_name):
+    url = f'{SERVICE_DISCOVERY}/get-service?name={service_name}'
+    try:
+        response = requests.get(url)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print("Service not found." if response.status_code == 404 else f"Error: {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred: {e}")
+
+
+class BroadcastDispatcher:
+    """Delivers the new jobs to the user service replicas in the background.
+
+    Jobs are queued by submit() and sent in batches of up to batch_size,
+    or whatever arrived within flush_interval, to the bulk broadcast
+    endpoint of one replica, which routes them to every subscriber.
+    Replicas are taken in turn. Server and connection errors get up to
+    max_retries more tries, on the next replicas, with exponential
+    backoff, then the batch is dropped.
+    """
+
+    def __init__(self, get_services=None, batch_size=50, flush_interval=1.0,
+                 max_retries=3, backoff=1.0, timeout=10, max_queued=10000) -> None:
+        self.get_services = get_services or (lambda: get_service_details("user-service"))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._next_service = -1
+
+    def submit(self, jobs):
+        """Queue jobs for delivery without waiting for it"""
+        self._start()
+        for job in jobs:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                BROADCAST_JOBS_DROPPED.inc()
+                print(f"Broadcast queue full, dropping {job.get('link')}")
+
+    def join(self):
+        """Wait until every queued job got delivered or dropped"""
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="broadcast-dispatcher", daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                BROADCAST_JOBS_DROPPED.inc(len(batch))
+                print(f"Could not broadcast {len(batch)} jobs: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch):
+        # Any replica reaches every subscriber, the next one takes over
+        # when it fails
+        user_services = self.get_services() or []
+        if not user_services:
+            raise Exception("no user service replica found")
+        for attempt in range(self.max_retries + 1):
+            self._next_service = (self._next_service + 1) % len(user_services)
+            user_service = user_services[self._next_service]
+            url = f"{user_service['serviceAddress']}:{user_service['servicePort']}/broadcast-jobs-to-users/bulk"
+            try:
+                response = self.session.post(url, json=batch, timeout=self.timeout)
+                if response.status_code < 300:
+                    BROADCAST_JOBS_SENT.inc(len(batch))
+                    return
+                error = f"status {response.status_code}"
+                # Only the server errors are worth retrying
+                if response.status_code < 500:
+                    break
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        BROADCAST_JOBS_DROPPED.inc(len(batch))
+        print(f"Could not broadcast {len(batch)} jobs to {url}: {error}")
+
+
+broadcast_dispatcher = BroadcastDispatcher()
@@ -0,0 +1,197 @@
+from collections import deque
+from prometheus_client import Counter as MetricCounter, Gauge
+import time
+
+from .. import redis_client
+
+
+CRAWL_PAGES_CLAIMED = MetricCounter(
+    'crawl_pages_claimed_total', 'Listing pages claimed from the shared crawl queue'
+)
+CRAWL_LEASES_RECLAIMED = MetricCounter(
+    'crawl_leases_reclaimed_total', 'Expired page leases put back in the crawl queue'
+)
+CRAWL_PAGES_FETCHED = MetricCounter(
+    'crawl_pages_fetched_total', 'Listing pages scraped by this replica'
+)
+CRAWL_PAGES_SKIPPED = MetricCounter(
+    'crawl_pages_skipped_total', 'Listing pages left out by the early stop of incremental runs'
+)
+CRAWL_RUN_PAGES_FETCHED = Gauge(
+    'crawl_run_pages_fetched', 'Listing pages scraped by this replica in its last run'
+)
+CRAWL_RUN_PAGES_SKIPPED = Gauge(
+    'crawl_run_pages_skipped', 'Listing pages this replica left out in its last run'
+)
+
+# Seeds the pages unless a run is on, or its leftover work is still queued.
+# The run is a full sweep if the last one was full_sweep_seconds ago.
+START_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('LLEN', KEYS[2]) > 0 or redis.call('ZCARD', KEYS[3]) > 0 then
+    redis.call('SET', KEYS[1], 'full', 'EX', ARGV[1])
+    return 0
+end
+local mode = 'incremental'
+if tonumber(ARGV[2]) <= 0 or redis.call('SET', KEYS[6], 1, 'NX', 'EX', ARGV[2]) then
+    mode = 'full'
+end
+redis.call('SET', KEYS[1], mode, 'EX', ARGV[1])
+redis.call('DEL', KEYS[4], KEYS[5])
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+return 1
+"""
+
+# Requeues the expired leases first, then leases the next page. The clock
+# is the redis server's, the replicas' may differ.
+CLAIM_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+local reclaimed = 0
+for _, page in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], page)
+    if tonumber(redis.call('HGET', KEYS[3], page) or 0) < tonumber(ARGV[2]) then
+        redis.call('LPUSH', KEYS[1], page)
+        reclaimed = reclaimed + 1
+    end
+end
+local page = redis.call('LPOP', KEYS[1])
+if page then
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[1]), page)
+    redis.call('HINCRBY', KEYS[3], page, 1)
+end
+return {page, reclaimed}
+"""
+
+
+def has_stale_streak(new_links_counts, length):
+    """Whether length consecutive pages' counts are 0, None for the pages not scraped"""
+    streak = 0
+    for count in new_links_counts:
+        streak = streak + 1 if count == 0 else 0
+        if streak >= length:
+            return True
+    return False
+
+
+class LocalCrawl:
+    """The pages of a run walked by this replica alone, with the interface
+    of the CrawlQueue the replicas share.
+    """
+
+    def __init__(self, pages, full_sweep=True) -> None:
+        self._pending = deque(pages)
+        self._results = {}
+        self.full_sweep = full_sweep
+
+    def pages(self):
+        while self._pending:
+            yield self._pending.popleft()
+
+    def record(self, page, new_links):
+        self._results[page] = new_links
+
+    def stale_streak(self, page, length):
+        return has_stale_streak(
+            [self._results.get(p) for p in range(page - length + 1, page + length)], length
+        )
+
+    def stop(self):
+        skipped = len(self._pending)
+        self._pending.clear()
+        return skipped
+
+
+class CrawlQueue:
+    """Listing pages of a crawl run shared by the scraper replicas in redis.
+
+    The first replica to start a run queues its pages, then every replica
+    claims pages off the queue until it is drained, so each page is
+    scraped by one of them. A claimed page is leased for lease_seconds;
+    the lease of a replica that died on it expires and the page is claimed
+    again, up to max_attempts times. A new run starts once run_seconds
+    have passed since the last one started.
+
+    Incremental runs record how many new links each page had, so that
+    the replica finding a streak of pages without any stops the run.
+    """
+
+    def __init__(self, name, lease_seconds=300, max_attempts=3, run_seconds=3600, poll_interval=5.0) -> None:
+        self.run_key = f"crawl:{name}:run"
+        self.pending_key = f"crawl:{name}:pending"
+        self.leases_key = f"crawl:{name}:leases"
+        self.attempts_key = f"crawl:{name}:attempts"
+        self.results_key = f"crawl:{name}:new_links"
+        self.full_sweep_key = f"crawl:{name}:full_sweep"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.run_seconds = run_seconds
+        self.poll_interval = poll_interval
+        self._start = redis_client.register_script(START_SCRIPT)
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+
+    def start(self, pages, full_sweep_seconds=0):
+        """Queue the pages for a new run, True if this replica started it"""
+        keys = [self.run_key, self.pending_key, self.leases_key, self.attempts_key,
+                self.results_key, self.full_sweep_key]
+        return bool(self._start(keys=keys, args=[self.run_seconds, full_sweep_seconds, *pages]))
+
+    @property
+    def full_sweep(self):
+        return redis_client.get(self.run_key) != "incremental"
+
+    def claim(self):
+        """The next page to scrape, or None if none is queued right now"""
+        page, reclaimed = self._claim(
+            keys=[self.pending_key, self.leases_key, self.attempts_key],
+            args=[self.lease_seconds, self.max_attempts]
+        )
+        if reclaimed:
+            CRAWL_LEASES_RECLAIMED.inc(reclaimed)
+        if page is None:
+            return None
+        CRAWL_PAGES_CLAIMED.inc()
+        return int(page)
+
+    def complete(self, page):
+        redis_client.zrem(self.leases_key, page)
+
+    def record(self, page, new_links):
+        redis_client.hset(self.results_key, page, new_links)
+
+    def stale_streak(self, page, length):
+        pages = list(range(page - length + 1, page + length))
+        counts = redis_client.hmget(self.results_key, pages)
+        return has_stale_streak([None if count is None else int(count) for count in counts], length)
+
+    def stop(self):
+        """Drop the pages nobody claimed yet, how many there were"""
+        pipeline = redis_client.pipeline()
+        pipeline.llen(self.pending_key)
+        pipeline.delete(self.pending_key)
+        return pipeline.execute()[0]
+
+    def finished(self):
+        pipeline = redis_client.pipeline()
+        pipeline.llen(self.pending_key)
+        pipeline.zcard(self.leases_key)
+        return not any(pipeline.execute())
+
+    def pages(self):
+        """Claim pages until the run is drained, waiting on the other
+        replicas' leases so the abandoned ones are picked up too.
+        """
+        while True:
+            page = self.claim()
+            if page is not None:
+                yield page
+                self.complete(page)
+            elif self.finished():
+                return
+            else:
+                time.sleep(self.poll_interval)
@@ -0,0 +1,36 @@
+from sqlalchemy import or_
+
+
+LOOKBACK_IDS = 1000
+
+
+class IdWatermark:
+    """Highest id caught up to, with the ids below it not seen yet.
+
+    Ids are handed out as rows are inserted but the rows only show up when
+    their transaction commits, so a row can appear after one with a higher
+    id was read. The missing ids within lookback of the highest one are
+    looked up again by every catch up, the older ones are taken for rows
+    rolled back.
+    """
+
+    def __init__(self, lookback=LOOKBACK_IDS) -> None:
+        self.lookback = lookback
+        self.max_id = 0
+        self.gaps = set()
+
+    def newer(self, column):
+        """Condition on the id column selecting the rows not seen yet"""
+        self.gaps = {gap for gap in self.gaps if gap > self.max_id - self.lookback}
+        if not self.gaps:
+            return column > self.max_id
+        return or_(column > self.max_id, column.in_(sorted(self.gaps)))
+
+    def seen(self, row_id):
+        """Record an id, False if it fills a gap below the highest one"""
+        if row_id <= self.max_id:
+            self.gaps.discard(row_id)
+            return False
+        self.gaps.update(range(max(self.max_id + 1, row_id - self.lookback), row_id))
+        self.max_id = row_id
+        return True
@@ -0,0 +1,47 @@
+from flask import Response, make_response, request
+from functools import wraps
+import redis
+
+from .. import redis_client
+from .title_index import normalize_keywords
+
+
+DATA_VERSION_KEY = "jobs:data_version"
+CACHE_TTL = 24 * 3600  # entries of old data versions expire on their own
+
+
+def bump_data_version():
+    """Invalidate every cached insight, called when jobs are inserted"""
+    redis_client.incr(DATA_VERSION_KEY)
+
+
+def cached_insight(keywords_arg=None):
+    """Cache the JSON response of an insight endpoint in redis.
+
+    Entries are keyed by endpoint and normalized keywords (a view or query
+    argument) under the current data version, so they stay valid until
+    the scraper inserts new jobs.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            keywords = kwargs.get(keywords_arg, request.args.get(keywords_arg)) \
+                if keywords_arg else None
+            try:
+                version = redis_client.get(DATA_VERSION_KEY) or 0
+                key = f"insights:{version}:{request.endpoint}:{normalize_keywords(keywords)}"
+                cached = redis_client.get(key)
+            except redis.RedisError:
+                return view(*args, **kwargs)
+            if cached is not None:
+                return Response(cached, mimetype='application/json')
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                try:
+                    redis_client.set(key, response.get_data(as_text=True), ex=CACHE_TTL)
+                except redis.RedisError:
+                    pass
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+from sqlalchemy import select
+
+from .. import db
+from ..models import Job
+from .id_watermark import IdWatermark
+
+
+# Currency codes stored in the snapshot, 0 is anything else
+CURRENCY_CODES = {"mdl": 1, "usd": 2, "euro": 3}
+
+
+def currency_rates(rates):
+    """Lookup array turning currency codes into multipliers, e.g. to mdl"""
+    lookup = np.zeros(len(CURRENCY_CODES) + 1)
+    for currency, rate in rates.items():
+        lookup[CURRENCY_CODES[currency]] = rate
+    return lookup
+
+
+class JobColumns:
+    def __init__(self, ids, salary, currency, experience) -> None:
+        self.ids = ids                  # int64, ascending
+        self.salary = salary            # float64, NaN when missing
+        self.currency = currency        # int8 currency code
+        self.experience = experience    # float64, NaN when missing
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class JobSnapshot:
+    """Columnar copy of the numeric job fields used by the salary insights.
+
+    New jobs are appended, so the snapshot catches up on the ids it hasn't
+    seen instead of reloading the table. The ones committed late are
+    merged back into id order.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._watermark = IdWatermark()
+        self._columns = JobColumns(
+            np.empty(0, dtype=np.int64), np.empty(0),
+            np.empty(0, dtype=np.int8), np.empty(0)
+        )
+
+    def sync(self):
+        """Add the jobs committed since the last sync (needs an app context)"""
+        with self._lock:
+            columns = self._columns
+            result = db.session.execute(
+                select(Job.id, Job.salary, Job.currency, Job.experience)
+                .where(self._watermark.newer(Job.id))
+                .order_by(Job.id)
+                .execution_options(yield_per=10000)
+            )
+
+            chunks = [[columns.ids], [columns.salary], [columns.currency], [columns.experience]]
+            in_order = True
+            for rows in result.partitions():
+                ids, salary, currency, experience = zip(*rows)
+                for job_id in ids:
+                    in_order = self._watermark.seen(job_id) and in_order
+                chunks[0].append(np.array(ids, dtype=np.int64))
+                chunks[1].append(np.array(salary, dtype=np.float64))
+                chunks[2].append(np.array(
+                    [CURRENCY_CODES.get(c, 0) for c in currency], dtype=np.int8
+                ))
+                chunks[3].append(np.array(experience, dtype=np.float64))
+
+            if len(chunks[0]) > 1:
+                columns = JobColumns(*(np.concatenate(chunk) for chunk in chunks))
+                if not in_order:
+                    order = np.argsort(columns.ids, kind="stable")
+                    columns = JobColumns(*(column[order] for column in (
+                        columns.ids, columns.salary, columns.currency, columns.experience
+                    )))
+                self._columns = columns
+            return self._columns
+
+
+job_snapshot = JobSnapshot()
@@ -0,0 +1,178 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+
+from .. import db
+from ..models import CURRENCIES, Job, Skill, SkillDemand, SkillsList
+from .skill_matcher import skill_matcher
+
+
+DATE_FORMAT = "%d.%m.%Y"  # the vacancies' publication dates
+CURRENCY_ALIASES = {"eur": "euro", "€": "euro", "$": "usd", "lei": "mdl"}
+
+
+def parse_date(text):
+    """The date of a vacancy, None if the text isn't one"""
+    try:
+        return datetime.strptime(text.strip(), DATE_FORMAT).date()
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_date(date):
+    return date.strftime(DATE_FORMAT) if date else None
+
+
+def normalize_currency(text):
+    """One of the CURRENCIES, None for anything else"""
+    if not text:
+        return None
+    currency = text.strip().lower()
+    currency = CURRENCY_ALIASES.get(currency, currency)
+    return currency if currency in CURRENCIES else None
+
+
+def job_row(data):
+    return {
+        "title": data.get("title"),
+        "salary": data.get("salary"),
+        "currency": normalize_currency(data.get("currency")),
+        "experience": data.get("experience"),
+        "link": data.get("link"),
+        "date": parse_date(data.get("date")),
+    }
+
+
+def skill_rows(job_id, data):
+    return [
+        {"job_id": job_id, "name": skill, "skill_id": skill_matcher.skill_id(skill), "counter": counter}
+        for skill, counter in (data.get("skills") or {}).items()
+    ]
+
+
+def lock_skill_ids(skills):
+    """The skill rows with the ids of skills deleted from the list since
+    the matcher loaded it resolved again, or NULL if the skill is gone.
+
+    The ids are locked until the transaction ends, so a compensating
+    delete running meanwhile waits instead of failing the insert.
+    """
+    def existing(ids):
+        return set(db.session.scalars(
+            select(SkillsList.id)
+            .where(SkillsList.id.in_(ids))
+            .with_for_update(read=True, key_share=True)
+        ))
+
+    ids = {row["skill_id"] for row in skills if row["skill_id"] is not None}
+    if not ids:
+        return skills
+    found = existing(ids)
+    if found == ids:
+        return skills
+
+    skill_matcher.refresh()
+    skills = [
+        dict(row, skill_id=skill_matcher.skill_id(row["name"])) if row["skill_id"] not in found else row
+        for row in skills
+    ]
+    ids = {row["skill_id"] for row in skills if row["skill_id"] is not None} - found
+    found |= existing(ids) if ids else set()
+    return [row if row["skill_id"] in found else dict(row, skill_id=None) for row in skills]
+
+
+def link_skill(skill_id, name):
+    """Reference a skills list entry from the skill rows of its name left
+    without one, e.g. by a delete of the skill, and count their jobs.
+    """
+    db.session.execute(
+        update(Skill)
+        .where(
+            Skill.name == name,
+            Skill.skill_id.is_(None) | Skill.skill_id.not_in(select(SkillsList.id))
+        )
+        .values(skill_id=skill_id)
+        .execution_options(synchronize_session=False)
+    )
+    demand = db.session.scalar(select(func.count()).where(Skill.skill_id == skill_id))
+    if demand:
+        statement = demand_insert()
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[SkillDemand.skill_id],
+            set_={"demand": statement.excluded.demand}
+        ), {"skill_id": skill_id, "demand": demand})
+
+
+def demand_insert():
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(SkillDemand)
+    return sqlite.insert(SkillDemand)
+
+
+def add_demand(skills):
+    """Count the jobs of the skill rows in the demand table, in the
+    transaction inserting them.
+    """
+    demand = Counter(row["skill_id"] for row in skills if row["skill_id"] is not None)
+    if not demand:
+        return
+    statement = demand_insert()
+    statement = statement.on_conflict_do_update(
+        index_elements=[SkillDemand.skill_id],
+        set_={"demand": SkillDemand.demand + statement.excluded.demand}
+    )
+    # In id order so concurrent batches lock the rows in the same order
+    db.session.execute(statement, [
+        {"skill_id": skill_id, "demand": count} for skill_id, count in sorted(demand.items())
+    ])
+
+
+def save_jobs(data_list):
+    """Save scraped jobs with their skills in one transaction.
+
+    All the jobs are inserted in one statement returning their ids, then
+    all their skills in another, and the skills' demand is counted. If the
+    batch fails, each job is retried in its own savepoint so one bad record
+    only loses itself. Returns the data of the jobs saved.
+    """
+    if not data_list:
+        return []
+    try:
+        # Links are unique, the ids are matched by link rather than
+        # relying on the order the rows come back in
+        job_ids = dict(db.session.execute(
+            insert(Job).returning(Job.link, Job.id),
+            [job_row(data) for data in data_list]
+        ).all())
+        skills = [
+            row
+            for data in data_list
+            for row in skill_rows(job_ids[data.get("link")], data)
+        ]
+        if skills:
+            skills = lock_skill_ids(skills)
+            db.session.execute(insert(Skill), skills)
+            add_demand(skills)
+        db.session.commit()
+        return list(data_list)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"Saving the jobs as a batch failed, saving them one by one: {e}")
+
+    saved = []
+    for data in data_list:
+        try:
+            with db.session.begin_nested():
+                job_id = db.session.scalar(insert(Job).returning(Job.id), job_row(data))
+                skills = skill_rows(job_id, data)
+                if skills:
+                    skills = lock_skill_ids(skills)
+                    db.session.execute(insert(Skill), skills)
+                    add_demand(skills)
+            saved.append(data)
+        except SQLAlchemyError as e:
+            print(f"Could not save {data.get('link')}: {e}")
+    db.session.commit()
+    return saved
@@ -0,0 +1,161 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from prometheus_client import Counter as MetricCounter
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from .response_cache import body_digest
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+PAGES_NOT_MODIFIED = MetricCounter(
+    'pages_not_modified_total', 'Cached pages the server answered a 304 for'
+)
+PAGES_UNCHANGED = MetricCounter(
+    'pages_unchanged_total', 'Fetched pages with the same body as the cached one'
+)
+
+FetchedPage = namedtuple("FetchedPage", ["url", "text", "changed", "etag", "last_modified"])
+
+
+class PageFetcher:
+    """Fetches pages over a pooled keep-alive session.
+
+    Concurrency is bounded by max_workers and adapted AIMD style: every
+    throttled (429/5xx), failed or slow response halves the number of
+    requests allowed in flight, a window of good responses adds one back.
+    Requests to the same host are also spaced by 1 / rate_per_host seconds.
+
+    With a ResponseCache, fetch_page() requests pages conditionally on
+    their cached ETag and Last-Modified and tells the pages whose body hash
+    is unchanged apart, so their parsing can be skipped. A page is only
+    cached by cache_page(), once whatever it links to has been handled.
+    """
+
+    def __init__(self, max_workers=8, rate_per_host=4, timeout=15,
+                 retries=3, backoff=1.0, slow_response=5.0, cache=None) -> None:
+        self.max_workers = max_workers
+        self.min_interval = 1 / rate_per_host if rate_per_host else 0
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.slow_response = slow_response
+        self.cache = cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._condition = threading.Condition()
+        self._limit = max_workers
+        self._in_flight = 0
+        self._successes = 0
+        self._rate_lock = threading.Lock()
+        self._next_request = {}
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def _acquire(self):
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release(self, ok):
+        with self._condition:
+            self._in_flight -= 1
+            if ok:
+                self._successes += 1
+                if self._successes >= self._limit and self._limit < self.max_workers:
+                    self._limit += 1
+                    self._successes = 0
+            else:
+                self._limit = max(1, self._limit // 2)
+                self._successes = 0
+            self._condition.notify_all()
+
+    def _wait_for_host(self, url):
+        host = urlsplit(url).netloc
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request.get(host, now))
+            self._next_request[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def fetch(self, url):
+        """Text of a page, retrying throttled and failed requests"""
+        return self._get(url, {}).text
+
+    def fetch_page(self, url):
+        """The page, changed unless it's the same as the cached one"""
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        response = self._get(url, headers)
+        if response.status_code == 304 and cached:
+            PAGES_NOT_MODIFIED.inc()
+            return FetchedPage(url, cached.text, False, cached.etag, cached.last_modified)
+        page = FetchedPage(
+            url, response.text, True, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        )
+        if cached and cached.digest == body_digest(response.text):
+            PAGES_UNCHANGED.inc()
+            return page._replace(changed=False)
+        return page
+
+    def cache_page(self, page):
+        """Keep a fetched page to request it conditionally next time"""
+        if self.cache is not None:
+            self.cache.put(page.url, page.text, page.etag, page.last_modified)
+
+    def _get(self, url, headers):
+        for attempt in range(self.retries + 1):
+            self._acquire()
+            response, ok = None, False
+            try:
+                self._wait_for_host(url)
+                start = time.monotonic()
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                ok = response.status_code not in RETRY_STATUSES \
+                    and time.monotonic() - start < self.slow_response
+            except requests.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+            finally:
+                self._release(ok)
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            if attempt == self.retries:
+                response.raise_for_status()
+
+            # Honour Retry-After when the server sends one
+            delay = self.backoff * 2 ** attempt
+            if response is not None and response.headers.get("Retry-After", "").isdigit():
+                delay = int(response.headers["Retry-After"])
+            time.sleep(delay)
+
+    def fetch_many(self, urls):
+        """(url, text) for every url in order, text is None if it failed"""
+        def fetch_or_none(url):
+            try:
+                return url, self.fetch(url)
+            except requests.exceptions.RequestException as e:
+                print(f"Could not fetch {url}: {e}")
+                return url, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(fetch_or_none, urls))
@@ -1,25 +1,42 @@
-from bs4 import BeautifulSoup as bs4
-import requests
+from bs4 import BeautifulSoup as bs4, SoupStrainer
 import re
 from unidecode import unidecode
-import demjson3
 
-from ..models import SkillsList
+from .page_fetcher import PageFetcher
+from .skill_matcher import skill_matcher
 
 
-extracted_skills = SkillsList.query.all()
-it_skills2 = [demjson3.decode(skill.name) for skill in extracted_skills]
-print(it_skills2)
+# The only parts of the listing and job pages the data is taken from
+JOBS_LIST = SoupStrainer("div", class_="b_info10 vacancy-list space-y-5")
+JOB_DETAIL = SoupStrainer("div", class_="vc_detail")
 
 
 class RabotaMdScraper:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, fetcher=None, base_url="https://www.rabota.md",
+                 parser="lxml", partial=True) -> None:
+        self.fetcher = fetcher or PageFetcher()
+        self.base_url = base_url
+        self.parser = parser
+        self.partial = partial
+
+    def make_soup(self, html, strainer):
+        """Parse a page, only the strainer's part of it in partial mode"""
+        return bs4(html, self.parser, parse_only=strainer if self.partial else None)
 
     def extract_page_links(self, url):
-        web_page = requests.get(url)
-        print("response", web_page.status_code)
-        soup = bs4(web_page.text, "html.parser")
+        return self.parse_page_links(self.fetcher.fetch(url))
+
+    def extract_listing_links(self, url, skip_unchanged=False):
+        """Links of the listing's jobs with the fetched page, no links if
+        skip_unchanged and the page is the same as when it was last cached.
+        """
+        page = self.fetcher.fetch_page(url)
+        if skip_unchanged and not page.changed:
+            return [], page
+        return self.parse_page_links(page.text), page
+
+    def parse_page_links(self, html):
+        soup = self.make_soup(html, JOBS_LIST)
 
         # Access the page container with the jobs
         jobs_page_container = soup.find(
@@ -38,7 +55,7 @@ class RabotaMdScraper:
         for job in jobs_containers:
             href = job.find_all("a")[1].get("href")
             if href:
-                job_page_link = "https://www.rabota.md" + href
+                job_page_link = self.base_url + href
                 jobs_pages_links.append(job_page_link)
 
         return jobs_pages_links
@@ -75,9 +92,21 @@ class RabotaMdScraper:
         return None
     
     def scrape_page_data(self, link):
+        return self.parse_page_data(link, self.fetcher.fetch(link))
+
+    def scrape_pages_data(self, links):
+        """Data of the jobs at the links, fetched concurrently.
+        The pages that could not be fetched are left out.
+        """
+        return [
+            self.parse_page_data(link, html)
+            for link, html in self.fetcher.fetch_many(links)
+            if html is not None
+        ]
+
+    def parse_page_data(self, link, html):
         job_data = {}
-        web_page = requests.get(link)
-        soup = bs4(web_page.text, "html.parser")
+        soup = self.make_soup(html, JOB_DETAIL)
 
         job_data["link"] = link
 
@@ -114,13 +143,7 @@ class RabotaMdScraper:
             job_data["salary"] = salary
             job_data["currency"] = currency
 
-        job_data["skills"] = {}
-        for skill in it_skills2:
-            skill_count = 0
-            for label in list(skill):
-                skill_count += text_to_analyze.count(" " + label + " ")
-            if skill_count > 0:
-                job_data["skills"][skill[0]] = skill_count
+        job_data["skills"] = skill_matcher.skills_in(text_to_analyze)
 
         return job_data
 
@@ -129,8 +152,7 @@ class RabotaMdScraper:
         data_list = []
         while page <= max_pages:
             jobs_pages_links = self.extract_page_links(url + str(page))
-            for link in jobs_pages_links:
-                data = self.scrape_page_data(link)
+            for data in self.scrape_pages_data(jobs_pages_links):
                 data_list.append(data)
                 print("\n"*5)
                 print(data)
@@ -0,0 +1,80 @@
+from collections import namedtuple
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+CachedResponse = namedtuple("CachedResponse", ["text", "etag", "last_modified", "digest"])
+
+
+def body_digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Fetched pages by url in a sqlite file, with their validators and
+    body hash, kept across restarts.
+
+    The bodies stored are bounded to max_bytes, the least recently used
+    responses are evicted past it.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+        """)
+        self._size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, url):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text, etag, last_modified, digest FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET used = ? WHERE url = ?", (time.time(), url))
+            return CachedResponse(*row)
+
+    def put(self, url, text, etag=None, last_modified=None):
+        """Store a response, the hash of its body"""
+        digest = body_digest(text)
+        size = len(text.encode())
+        with self._lock:
+            old = self._connection.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, text, etag, last_modified, digest, size, time.time())
+            )
+            self._size += size - (old[0] if old else 0)
+            self._evict()
+        return digest
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        evicted = []
+        for url, size in self._connection.execute("SELECT url, size FROM responses ORDER BY used, rowid"):
+            if self._size <= self.max_bytes:
+                break
+            evicted.append((url,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -0,0 +1,62 @@
+from prometheus_client import Counter as MetricCounter
+from sqlalchemy import select
+import redis
+
+from .. import db, redis_client
+from ..models import Job
+
+
+SEEN_LINKS_KEY = "jobs:seen_links"
+
+SEEN_LINK_HITS = MetricCounter(
+    'seen_links_hits_total', 'Scraped links skipped by the seen links set'
+)
+SEEN_LINK_MISSES = MetricCounter(
+    'seen_links_misses_total', 'Scraped links looked up in the database'
+)
+
+
+class SeenLinks:
+    """Links of the jobs already saved, kept in a redis set so the
+    known links of a listing page are skipped without a database query.
+    """
+
+    def __init__(self, key=SEEN_LINKS_KEY) -> None:
+        self.key = key
+
+    def new_links(self, links):
+        """The links, in order and without duplicates, of jobs not saved yet"""
+        links = list(dict.fromkeys(links))
+        if not links:
+            return []
+        try:
+            seen = redis_client.smismember(self.key, links)
+        except redis.RedisError:
+            seen = [False] * len(links)
+        unknown = [link for link, is_seen in zip(links, seen) if not is_seen]
+        SEEN_LINK_HITS.inc(len(links) - len(unknown))
+        SEEN_LINK_MISSES.inc(len(unknown))
+        if not unknown:
+            return []
+
+        # One lookup for the rest, the ones found are remembered
+        saved = set(db.session.scalars(select(Job.link).where(Job.link.in_(unknown))))
+        self.mark_seen(saved)
+        return [link for link in unknown if link not in saved]
+
+    def mark_seen(self, links):
+        if not links:
+            return
+        try:
+            redis_client.sadd(self.key, *links)
+        except redis.RedisError:
+            pass
+
+    def clear(self):
+        try:
+            redis_client.delete(self.key)
+        except redis.RedisError:
+            pass
+
+
+seen_links = SeenLinks()
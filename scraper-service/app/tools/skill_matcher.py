@@ -0,0 +1,103 @@
+import threading
+import demjson3
+from sqlalchemy import func
+
+from .. import db
+from ..models import SkillsList
+
+
+END = None  # trie key marking the end of an alias
+
+
+def compile_aliases(skills):
+    """Trie over the space separated words of every alias of the skills"""
+    trie = {}
+    for skill in skills:
+        for label in skill:
+            node = trie
+            for word in label.split(" "):
+                node = node.setdefault(word, {})
+            node[END] = label
+    return trie
+
+
+def count_aliases(trie, text):
+    """How many times each alias appears in the text surrounded by spaces.
+
+    Gives the same counts as text.count(" " + label + " ") for every label,
+    non overlapping occurrences included, in one pass over the words.
+    """
+    words = text.split(" ")
+    last = len(words) - 1
+    counts, next_start = {}, {}
+    # An alias needs a space before its first word and after its last one
+    for start in range(1, last):
+        node, end = trie.get(words[start]), start
+        while node is not None:
+            label = node.get(END)
+            if label is not None and start >= next_start.get(label, 0):
+                counts[label] = counts.get(label, 0) + 1
+                # The next occurrence can't reuse the trailing space
+                next_start[label] = end + 2
+            end += 1
+            if end >= last:
+                break
+            node = node.get(words[end])
+    return counts
+
+
+class SkillMatcher:
+    """Finds the skills of the skills list mentioned in a page's text.
+
+    The aliases are compiled once and recompiled when the skills list
+    changes, either when told so by the saga endpoints or when refresh()
+    sees a different list size or last id.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version = None
+        self._compiled = None  # (skills, trie)
+        self._ids = {}
+
+    def invalidate(self):
+        self._version = None
+
+    def refresh(self):
+        version = tuple(db.session.query(
+            func.count(SkillsList.id), func.max(SkillsList.id)
+        ).one())
+        if version == self._version:
+            return
+        with self._lock:
+            rows = SkillsList.query.order_by(SkillsList.id).all()
+            skills = [demjson3.decode(row.name) for row in rows]
+            ids = {}
+            for row, skill in zip(rows, skills):
+                ids.setdefault(skill[0], row.id)
+            self._compiled = (skills, compile_aliases(skills))
+            self._ids = ids
+            self._version = version
+
+    def skills_in(self, text):
+        """Mentions of each skill by its first alias, like the per alias count loop"""
+        if self._version is None:
+            self.refresh()
+        skills, trie = self._compiled
+        counts = count_aliases(trie, text)
+
+        found = {}
+        for skill in skills:
+            skill_count = sum(counts.get(label, 0) for label in skill)
+            if skill_count > 0:
+                found[skill[0]] = skill_count
+        return found
+
+    def skill_id(self, name):
+        """Id of the skills list entry of a skill named like skills_in() does"""
+        if self._version is None:
+            self.refresh()
+        return self._ids.get(name)
+
+
+skill_matcher = SkillMatcher()
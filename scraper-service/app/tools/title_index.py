@@ -0,0 +1,170 @@
+from collections import Counter, OrderedDict
+import threading
+from fuzzywuzzy import fuzz, utils
+from prometheus_client import Counter as MetricCounter
+
+from .. import db
+from ..models import Job
+from .id_watermark import IdWatermark
+
+
+def title_signature(title):
+    """The token set fuzz.token_set_ratio compares for a title"""
+    if title is None:
+        return frozenset()
+    return frozenset(utils.full_process(title, force_ascii=True).split())
+
+
+def normalize_keywords(keywords):
+    """Keywords are fuzzy matched by token set, so case, order, punctuation
+    and repeated words don't change the result"""
+    return " ".join(sorted(title_signature(keywords)))
+
+
+class TitleIndex:
+    """In-process inverted index over job titles.
+
+    fuzz.token_set_ratio only depends on the token sets of the two strings,
+    so jobs are grouped by title signature and every signature is scored at
+    most once per search. Signatures sharing a token with the query are
+    always scored; the others can only reach the threshold through
+    character overlap, which is bounded by length and character counts
+    before paying for the real ratio.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._jobs = {}        # signature -> job ids
+        self._titles = {}      # signature -> a title with that signature
+        self._postings = {}    # token -> signatures
+        self._by_length = {}   # length of the sorted token string -> signatures
+        self._watermark = IdWatermark()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def generation(self):
+        """Changes whenever jobs are added to the index"""
+        return self._size
+
+    def extend(self, rows):
+        with self._lock:
+            for job_id, title in rows:
+                self._add(job_id, title)
+                self._watermark.seen(job_id)
+
+    def _add(self, job_id, title):
+        self._size += 1
+        signature = title_signature(title)
+        if not signature:
+            # Empty titles score 0 against anything
+            return
+
+        job_ids = self._jobs.get(signature)
+        if job_ids is not None:
+            job_ids.append(job_id)
+            return
+
+        self._jobs[signature] = [job_id]
+        self._titles[signature] = title
+        for token in signature:
+            self._postings.setdefault(token, set()).add(signature)
+        length = len(" ".join(signature))
+        self._by_length.setdefault(length, set()).add(signature)
+
+    def sync(self):
+        """Index the jobs committed since the last sync (needs an app context)"""
+        with self._sync_lock:
+            rows = (
+                db.session.query(Job.id, Job.title)
+                .filter(self._watermark.newer(Job.id))
+                .order_by(Job.id)
+                .yield_per(1000)
+            )
+            self.extend(rows)
+
+    def search(self, query, threshold):
+        """Ids of the jobs whose title scores >= threshold, in id order"""
+        query_signature = title_signature(query)
+        if not query_signature:
+            return []
+
+        with self._lock:
+            sharing = set()
+            for token in query_signature:
+                sharing.update(self._postings.get(token, ()))
+            candidates = [(s, self._titles[s]) for s in sharing]
+
+            # Without a shared token the score is the plain ratio of the two
+            # sorted token strings, which can't exceed 2*min(la, lb)/(la + lb)
+            # (scores are rounded, hence the half point of slack)
+            query_string = " ".join(sorted(query_signature))
+            la, k = len(query_string), 2 * threshold - 1
+            for length in range(la * k // (400 - k), la * (400 - k) // k + 1):
+                if 400 * min(la, length) < k * (la + length):
+                    continue
+                for signature in self._by_length.get(length, ()):
+                    if signature not in sharing:
+                        candidates.append((signature, self._titles[signature]))
+
+        query_chars = Counter(query_string)
+        matches = []
+        for signature, title in candidates:
+            if signature not in sharing:
+                title_string = " ".join(sorted(signature))
+                overlap = sum((query_chars & Counter(title_string)).values())
+                if 400 * overlap < k * (la + len(title_string)):
+                    continue
+            if fuzz.token_set_ratio(query, title) >= threshold:
+                matches.extend(self._jobs[signature])
+
+        matches.sort()
+        return matches
+
+
+MEMO_HITS = MetricCounter(
+    'keyword_match_memo_hits_total', 'Keyword searches answered from the match memo'
+)
+MEMO_MISSES = MetricCounter(
+    'keyword_match_memo_misses_total', 'Keyword searches that had to search the title index'
+)
+
+
+class MatchMemo:
+    """Process-local LRU of normalized keywords -> matching job ids.
+
+    Entries are tagged with the index generation they were computed at, so
+    they are recomputed once new jobs are indexed.
+    """
+
+    def __init__(self, index, maxsize=256) -> None:
+        self._index = index
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def matching_jobs(self, keywords, threshold):
+        key = (normalize_keywords(keywords), threshold)
+        generation = self._index.generation
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                MEMO_HITS.inc()
+                return entry[1]
+
+        MEMO_MISSES.inc()
+        job_ids = self._index.search(keywords, threshold)
+        with self._lock:
+            self._entries[key] = (generation, job_ids)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return job_ids
+
+
+title_index = TitleIndex()
+match_memo = MatchMemo(title_index)
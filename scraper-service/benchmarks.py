@@ -0,0 +1,321 @@
+"""Benchmarks for the scraper service hot paths.
+
+Run from the scraper-service directory, e.g.:
+    python benchmarks.py title-index --sizes 10000 100000 1000000
+    python benchmarks.py parse-pages --fixtures fixtures/rabota_md
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from itertools import accumulate
+from flask import Flask
+from fuzzywuzzy import fuzz
+from sqlalchemy import insert
+
+from app import db
+from app.models import Job, Skill, SkillsList
+from app.apis.data import list_skills_by_salary
+from app.tools.title_index import TitleIndex, title_signature
+from app.tools.job_snapshot import JobSnapshot
+from app.tools.rabota_md_scraper import RabotaMdScraper
+from app.tools.job_store import job_row, save_jobs
+
+
+SENIORITY = ["", "junior", "middle", "senior", "lead", "principal", "stagiar"]
+TECHS = [
+    "python", "java", "javascript", "typescript", "c#", ".net", "php", "go",
+    "ruby", "react", "angular", "vue", "node.js", "django", "flutter", "ios",
+    "android", "sql", "devops", "qa", "data", "ml", "cloud", "sap", "1c",
+]
+ROLES = [
+    "developer", "engineer", "programmer", "programator", "tester",
+    "administrator", "analyst", "architect", "specialist", "manager",
+]
+SUFFIXES = ["", "remote", "(full-time)", "/ part-time", "chisinau", "team lead"]
+QUERIES = ["python developer", "senior java", "qa engineer", "administrator", "react"]
+CURRENCIES = ["mdl", "mdl", "usd", "euro", None]
+SKILLS = [
+    "python", "java", "javascript", "sql", "docker", "git", "linux", "react",
+    "english", "aws", "c#", ".net", "php", "html", "css", "agile", "jira",
+]
+
+
+def synthetic_vocabulary(size, rnd):
+    """Made up words, e.g. company, product and place names, and their
+    cumulative Zipf weights: a few are common, most are rare.
+    """
+    words = [
+        "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10)))
+        for _ in range(size)
+    ]
+    return words, list(accumulate(1 / rank for rank in range(1, size + 1)))
+
+
+def synthetic_titles(n, seed=0, vocabulary_size=50_000):
+    """Titles built from the common job title words, most with a few words
+    of a long tailed vocabulary so the signatures spread like real ones.
+    """
+    rnd = random.Random(seed)
+    words, weights = synthetic_vocabulary(vocabulary_size, rnd)
+    return [
+        " ".join(filter(None, [
+            rnd.choice(SENIORITY), rnd.choice(TECHS),
+            rnd.choice(ROLES), rnd.choice(SUFFIXES),
+            *rnd.choices(words, cum_weights=weights, k=rnd.choice([0, 1, 1, 2, 3]))
+        ]))
+        for _ in range(n)
+    ]
+
+
+def synthetic_jobs(n, seed=0):
+    rnd = random.Random(seed)
+    for i, title in enumerate(synthetic_titles(n, seed), start=1):
+        currency = rnd.choice(CURRENCIES)
+        yield {
+            "title": title,
+            "salary": rnd.randint(500, 60000) if currency else None,
+            "currency": currency,
+            "experience": rnd.choice([0, 0.5, 1, 2, 3, 5]),
+            "link": f"https://www.rabota.md/ro/jobs/{i}",
+            "date": "01.01.2024",
+        }
+
+
+def synthetic_skills(n, seed=0):
+    rnd = random.Random(seed)
+    for job_id in range(1, n + 1):
+        for name in rnd.sample(SKILLS, rnd.randint(1, 6)):
+            yield {"job_id": job_id, "name": name, "counter": rnd.randint(1, 3)}
+
+
+def bench_app(size, database="sqlite://"):
+    """Database (in memory by default) filled with synthetic jobs and skills"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(SkillsList), [{"name": str([name])} for name in SKILLS])
+        if size:
+            db.session.execute(insert(Job), [job_row(data) for data in synthetic_jobs(size)])
+            db.session.execute(insert(Skill), list(synthetic_skills(size)))
+        db.session.commit()
+    return app
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def measure(func):
+    """Wall time and peak traced memory of a call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_title_index(args):
+    for size in args.sizes:
+        titles = synthetic_titles(size)
+
+        start = time.perf_counter()
+        index = TitleIndex()
+        index.extend(enumerate(titles, start=1))
+        build = time.perf_counter() - start
+        # Every distinct signature is a candidate to score, not every job
+        signatures = len({title_signature(title) for title in titles})
+        print(f"\n{size} jobs, {signatures} distinct title signatures: index built in {build:.2f}s")
+
+        for query in QUERIES:
+            start = time.perf_counter()
+            found = index.search(query, 80)
+            indexed = time.perf_counter() - start
+
+            if size <= args.max_scan:
+                start = time.perf_counter()
+                scanned = [
+                    job_id for job_id, title in enumerate(titles, start=1)
+                    if fuzz.token_set_ratio(query, title) >= 80
+                ]
+                scan = time.perf_counter() - start
+                assert scanned == found, query
+                scan = f"{scan * 1000:10.1f}ms"
+            else:
+                scan = "   skipped"
+
+            print(f"  {query:<18} matches={len(found):<8} "
+                  f"index={indexed * 1000:8.1f}ms  full scan={scan}")
+
+
+def bench_job_snapshot(args):
+    for size in args.sizes:
+        app = bench_app(size)
+        with app.app_context():
+            def orm_average():
+                total_salary, salary_count = 0, 0
+                for job in Job.query.all():
+                    if job.salary is not None:
+                        if job.currency == "usd":
+                            total_salary += job.salary * 17.66
+                        elif job.currency == "euro":
+                            total_salary += job.salary * 19.33
+                        elif job.currency == "mdl":
+                            total_salary += job.salary
+                        salary_count += 1
+                return total_salary / salary_count
+            _, orm_time, orm_peak = measure(orm_average)
+            db.session.expunge_all()
+
+            snapshot = JobSnapshot()
+            jobs, load_time, load_peak = measure(snapshot.sync)
+            _, sync_time, sync_peak = measure(snapshot.sync)
+            resident = sum(column.nbytes for column in (
+                jobs.ids, jobs.salary, jobs.currency, jobs.experience
+            ))
+
+        print(f"\n{size} jobs")
+        print(f"  ORM objects per call: {orm_time * 1000:9.1f}ms  peak {orm_peak / 2**20:8.1f}MiB")
+        print(f"  snapshot first load:  {load_time * 1000:9.1f}ms  peak {load_peak / 2**20:8.1f}MiB")
+        print(f"  snapshot per call:    {sync_time * 1000:9.1f}ms  peak {sync_peak / 2**20:8.1f}MiB"
+              f"  resident {resident / 2**20:.1f}MiB")
+
+
+def bench_skills_by_salary(args):
+    for size in args.sizes:
+        app = bench_app(size)
+        with app.app_context():
+            def per_job_lists():
+                skills_salary = {}
+                for job in Job.query.all():
+                    if job.salary is not None:
+                        currency = job.currency.lower()
+                        for skill in job.skills:
+                            if skill.name not in skills_salary:
+                                skills_salary[skill.name] = {"usd": [], "mdl": [], "euro": []}
+                            if currency in skills_salary[skill.name]:
+                                skills_salary[skill.name][currency].append(job.salary)
+                result = []
+                for skill, salaries in skills_salary.items():
+                    if all(len(salaries[c]) >= 10 for c in salaries):
+                        avg = (sum(salaries["euro"]) / len(salaries["euro"])
+                               + sum(salaries["usd"]) / len(salaries["usd"]) * 0.91
+                               + sum(salaries["mdl"]) / len(salaries["mdl"]) * 0.052) / 3
+                        result.append({"skill": skill, "avg": avg,
+                                       "jobs": sum(len(v) for v in salaries.values())})
+                result.sort(key=lambda x: x['avg'], reverse=True)
+                return result
+            expected, loop_time = timed(per_job_lists)
+            db.session.expunge_all()
+
+            with app.test_request_context():
+                response, query_time = timed(list_skills_by_salary)
+            grouped = response.json
+            assert [r["skill"] for r in grouped] == [r["skill"] for r in expected]
+            assert [r["jobs"] for r in grouped] == [r["jobs"] for r in expected]
+
+        print(f"{size:>8} jobs: per-job loop {loop_time * 1000:9.1f}ms  "
+              f"grouped query {query_time * 1000:8.1f}ms")
+
+
+def bench_parse_pages(args):
+    pages = []
+    for name in sorted(os.listdir(args.fixtures)):
+        with open(os.path.join(args.fixtures, name), encoding="utf-8") as f:
+            pages.append((name, f.read()))
+    listings = [html for name, html in pages if name.startswith("listing")]
+    details = [(name, html) for name, html in pages if not name.startswith("listing")]
+    print(f"{len(listings)} listing and {len(details)} job pages, "
+          f"{sum(len(html) for _, html in pages) / 1024:.0f}KiB, x{args.repeat}\n")
+
+    app = bench_app(0)
+    with app.app_context():
+        expected = None
+        for parser, partial in [("html.parser", False), ("html.parser", True),
+                                ("lxml", False), ("lxml", True)]:
+            scraper = RabotaMdScraper(parser=parser, partial=partial)
+
+            def parse_all():
+                links = [scraper.parse_page_links(html) for html in listings]
+                data = [scraper.parse_page_data(name, html) for name, html in details]
+                return links, data
+            extracted, elapsed = timed(lambda: [parse_all() for _ in range(args.repeat)][-1])
+            _, _, peak = measure(parse_all)
+
+            expected = expected or extracted
+            assert extracted == expected, (parser, partial)
+            label = f"{parser}{' partial' if partial else ''}"
+            print(f"  {label:<20} {len(pages) * args.repeat / elapsed:8.1f} pages/s  "
+                  f"peak {peak / 2**20:6.2f}MiB")
+
+
+def bench_save_jobs(args):
+    def scraped_pages(size, prefix):
+        rnd = random.Random(size)
+        pages, page = [], []
+        for i, job in enumerate(synthetic_jobs(size)):
+            job["link"] = f"https://www.rabota.md/ro/jobs/{prefix}/{i}"
+            job["skills"] = {name: rnd.randint(1, 3) for name in rnd.sample(SKILLS, rnd.randint(1, 6))}
+            page.append(job)
+            if len(page) == args.page_size:
+                pages.append(page)
+                page = []
+        return pages + [page] if page else pages
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database or f"sqlite:///{directory}/bench.db"
+        app = bench_app(0, database)
+        with app.app_context():
+            for size in args.sizes:
+                def per_job_commits():
+                    for page in scraped_pages(size, f"loop-{size}"):
+                        for data in page:
+                            job = Job(**job_row(data))
+                            db.session.add(job)
+                            db.session.commit()
+                            for name, counter in data["skills"].items():
+                                db.session.add(Skill(job_id=job.id, name=name, counter=counter))
+                            db.session.commit()
+                _, loop_time = timed(per_job_commits)
+
+                def batched():
+                    for page in scraped_pages(size, f"batch-{size}"):
+                        save_jobs(page)
+                _, batch_time = timed(batched)
+
+                print(f"{size:>8} jobs: two commits per job {size / loop_time:9.0f} jobs/s  "
+                      f"batch per page {size / batch_time:9.0f} jobs/s")
+            db.drop_all()
+
+
+BENCHMARKS = {
+    "title-index": bench_title_index,
+    "job-snapshot": bench_job_snapshot,
+    "skills-by-salary": bench_skills_by_salary,
+    "parse-pages": bench_parse_pages,
+    "save-jobs": bench_save_jobs,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--max-scan", type=int, default=100_000,
+                        help="largest size to also time the full fuzzy scan on")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(__file__), "fixtures", "rabota_md"),
+                        help="directory of saved listing*.html and job pages")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database", help="database url to save jobs to, a temporary sqlite file by default")
+    parser.add_argument("--page-size", type=int, default=20, help="jobs scraped per listing page")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
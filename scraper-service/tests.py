@@ -0,0 +1,995 @@
+import pytest
+import datetime
+import hashlib
+import json
+import os
+import redis
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fuzzywuzzy import fuzz
+from flask import Flask
+from sqlalchemy import event, text
+from app.models import Job, Skill, SkillDemand, SkillsList, SchemaMigration
+from app import db, create_app, redis_client
+from app.tools.title_index import TitleIndex, MatchMemo, MEMO_HITS, MEMO_MISSES
+from app.tools.insights_cache import bump_data_version
+from app.tools.crawl_queue import CrawlQueue, LocalCrawl, CRAWL_LEASES_RECLAIMED, CRAWL_RUN_PAGES_SKIPPED
+from app.tools.broadcast_dispatcher import BroadcastDispatcher, BROADCAST_JOBS_SENT, BROADCAST_JOBS_DROPPED
+from app.tools.job_store import save_jobs
+from app.migrations import migrate, normalize_skills
+from app.tools.page_fetcher import PageFetcher, PAGES_NOT_MODIFIED, PAGES_UNCHANGED
+from app.tools.response_cache import ResponseCache
+from app.tools.seen_links import SeenLinks, SEEN_LINK_HITS, SEEN_LINK_MISSES
+from app.tools.skill_matcher import skill_matcher, compile_aliases, count_aliases
+
+
+TITLES = [
+    "Python Developer",
+    "Senior Python Developer",
+    "Python Developers",
+    "Pyton Developer",
+    "Developer Python (Django)",
+    "Junior Java Developer",
+    "Java Developer",
+    "Javascript Developer",
+    "Frontend Developer React",
+    "Front-end Developer / React.js",
+    "QA Engineer",
+    "QA Automation Engineer",
+    "Software Engineer",
+    "Software Engeneer",
+    "Administrator de sistem",
+    "Administrator baze de date",
+    "Specialist IT",
+    "Specialist în securitate IT",
+    "Manager de proiect IT",
+    "Project Manager",
+    "DevOps Engineer",
+    ".NET Developer",
+    "C# Developer",
+    "",
+    None,
+]
+
+QUERIES = [
+    "python", "python developer", "developers", "java", "react developer",
+    "qa", "engineer", "softwar enginer", "administrator", "manager it",
+    "devops", "c#", "", None, "???", "specialist securitate",
+]
+
+
+# Helper function to fill an index with jobs
+def build_index(titles):
+    index = TitleIndex()
+    index.extend(enumerate(titles, start=1))
+    return index
+
+# Helper function computing an average salary the way the endpoints used to
+def loop_average_salary(jobs, usd, euro):
+    total_salary, salary_count = 0, 0
+    for job in jobs:
+        if job.salary is not None:
+            if job.currency == "usd":
+                total_salary += job.salary * usd
+            elif job.currency == "euro":
+                total_salary += job.salary * euro
+            elif job.currency == "mdl":
+                total_salary += job.salary
+            salary_count += 1
+    return total_salary / salary_count if salary_count > 0 else 0, salary_count
+
+# Helper function counting skills one str.count pass per alias, like the scraper used to
+def loop_skill_counts(skills, text):
+    found = {}
+    for skill in skills:
+        skill_count = 0
+        for label in list(skill):
+            skill_count += text.count(" " + label + " ")
+        if skill_count > 0:
+            found[skill[0]] = skill_count
+    return found
+
+# Helper context manager counting the SQL statements sent to the database
+@contextmanager
+def count_queries():
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+# Helper context manager collecting the query plans of the SELECTs sent to the database
+@contextmanager
+def query_plans():
+    dialect = db.engine.dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        pytest.skip(f"No query plans for {dialect}")
+    selects, plans = [], []
+    def before_cursor_execute(conn, cursor, statement, parameters, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append((statement, parameters))
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield plans
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    for statement, parameters in selects:
+        plans.append((statement, explain(dialect, statement, parameters)))
+
+# Helper function giving the steps of a SELECT's plan, with the indexes they use
+def explain(dialect, statement, parameters):
+    connection = db.session.connection()
+    if dialect == "sqlite":
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        return " / ".join(row[-1] for row in rows)
+    # The test tables are small enough for postgres to scan them anyway
+    connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    nodes, steps = [plan[0]["Plan"]], []
+    while nodes:
+        node = nodes.pop()
+        steps.append(" ".join(filter(None, (node["Node Type"], node.get("Index Name"), node.get("Relation Name")))))
+        nodes.extend(node.get("Plans", ()))
+    return " / ".join(steps)
+
+# Helper function adding jobs with a few skills each
+def add_jobs_with_skills(count, prefix):
+    for i in range(count):
+        job = Job(title="Blockchain Backend Engineer", link=f"https://example.com/{prefix}/{i}")
+        db.session.add(job)
+        db.session.flush()
+        for name in ("python", "docker", "git"):
+            db.session.add(Skill(name=name, job_id=job.id, counter=1))
+    db.session.commit()
+    bump_data_version()
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "rabota_md")
+FIXTURE_LINKS = [f"/ro/jobs/{id}" for id in range(101, 107)]
+
+def clear_crawl_queues():
+    for key in redis_client.scan_iter("crawl:tests_*"):
+        redis_client.delete(key)
+
+# Local stand-in for rabota.md serving the fixture pages
+class FixtureHandler(BaseHTTPRequestHandler):
+    delay = 0.05
+    throttled = set()  # paths answered with a 429 the first time
+    validators = False  # ETag and Last-Modified sent, conditional requests answered
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.hits.append(self.path)
+            if "If-None-Match" in self.headers:
+                server.conditional.append(self.path)
+            throttle = self.path in self.throttled and self.path not in server.throttled_once
+            if throttle:
+                server.throttled_once.add(self.path)
+        try:
+            time.sleep(self.delay)
+            if throttle:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self.path.startswith("/ro/vacancies/category/it/"):
+                name = "listing.html"
+            else:
+                name = f"vacancy_{self.path.rsplit('/', 1)[-1]}.html"
+            path = os.path.join(FIXTURES, name)
+            if not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            if self.validators:
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+            self.send_response(200)
+            if self.validators:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", "Sat, 12 Oct 2024 10:00:00 GMT")
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+@contextmanager
+def fixture_server(throttled=(), validators=False):
+    handler = type("Handler", (FixtureHandler,), {"throttled": set(throttled), "validators": validators})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.lock = threading.Lock()
+    server.in_flight, server.max_in_flight = 0, 0
+    server.hits, server.conditional, server.throttled_once = [], [], set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# Local stand-in for a user service replica, failing the first posts
+@contextmanager
+def broadcast_server(failures=0, status=503):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with server.lock:
+                server.attempts += 1
+                failed = server.attempts <= failures
+                if not failed:
+                    server.batches.append((self.path, body))
+            self.send_response(status if failed else 200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.lock, server.attempts, server.batches = threading.Lock(), 0, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server, [{"serviceAddress": "http://127.0.0.1", "servicePort": server.server_port}]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture(scope='module')
+def test_client():
+    # Setup: Create a new app for testing
+    flask_app = create_app()
+
+    # Flask provides a way to access test request context
+    with flask_app.test_client() as testing_client:
+        with flask_app.app_context():
+            # Create test database schema
+            db.create_all()
+            yield testing_client
+            # Teardown: Drop the test database
+            db.drop_all()
+
+def test_title_index_matches_full_scan():
+    """Test that the title index returns exactly what a full fuzzy scan returns"""
+    index = build_index(TITLES)
+    for query in QUERIES:
+        for threshold in (80, 85):
+            expected = [
+                job_id for job_id, title in enumerate(TITLES, start=1)
+                if fuzz.token_set_ratio(query, title) >= threshold
+            ]
+            assert index.search(query, threshold) == expected, query
+
+def test_title_index_groups_duplicate_titles():
+    """Test that jobs with the same title are all returned"""
+    index = build_index(["Python Developer", "python  developer!", "Java Developer"])
+    assert len(index) == 3
+    assert index.search("python developer", 80) == [1, 2]
+
+def test_index_and_snapshot_pick_up_late_commits(test_client):
+    """Test that a job committed after one with a higher id is still indexed and snapshotted"""
+    from app.tools.job_snapshot import JobSnapshot
+    index, snapshot = TitleIndex(), JobSnapshot()
+    max_id = db.session.scalar(db.select(db.func.max(Job.id))) or 0
+    db.session.add(Job(id=max_id + 2, title="Late Erlang Wizard", link="https://example.com/late/2", salary=2))
+    db.session.commit()
+    index.sync()
+    generation = index.generation
+    assert snapshot.sync().ids[-1] == max_id + 2
+
+    # The transaction inserting the lower id commits last
+    db.session.add(Job(id=max_id + 1, title="Late Erlang Wizard", link="https://example.com/late/1", salary=1))
+    db.session.commit()
+    index.sync()
+    assert index.search("late erlang wizard", 90) == [max_id + 1, max_id + 2]
+    assert index.generation != generation
+    jobs = snapshot.sync()
+    assert list(jobs.ids[-2:]) == [max_id + 1, max_id + 2]
+    assert list(jobs.salary[-2:]) == [1, 2]
+    assert len(jobs) == len(set(jobs.ids))
+    Job.query.filter(Job.link.like("https://example.com/late/%")).delete(synchronize_session=False)
+    db.session.commit()
+
+def test_find_jobs(test_client):
+    """Test that /find-jobs picks up jobs inserted after the first search"""
+    test_client.get('/find-jobs', query_string={"title": "python developer"})
+    db.session.add(Job(title="Senior Python Developer", link="https://example.com/1"))
+    db.session.add(Job(title="Accountant", link="https://example.com/2"))
+    db.session.commit()
+    bump_data_version()
+
+    response = test_client.get('/find-jobs', query_string={"title": "python developer"})
+    assert response.status_code == 200
+    assert response.json["total_jobs"] == 2
+    assert [job["title"] for job in response.json["jobs"]] == ["Senior Python Developer"]
+
+def test_salary_insights_match_per_job_loop(test_client):
+    """Test that the salary endpoints give the same numbers as looping over the jobs"""
+    for i, (salary, currency, experience) in enumerate([
+        (1000, "usd", 1), (800, "euro", 2), (15000, "mdl", 1.2), (None, None, 3),
+        (2000, "usd", 0.9), (500, None, 1), (30000, "mdl", 5), (1200, "euro", 1),
+    ]):
+        title = "Python Developer" if i % 2 else "Java Developer"
+        db.session.add(Job(
+            title=title, salary=salary, currency=currency,
+            experience=experience, link=f"https://example.com/salary/{i}"
+        ))
+        db.session.commit()
+        bump_data_version()
+        jobs = Job.query.all()
+
+        average, count = loop_average_salary(jobs, 17.66, 19.33)
+        response = test_client.get('/average-job-salary')
+        assert response.json["jobs_num"] == count
+        assert response.json["average_salary"] == pytest.approx(average)
+
+        average, count = loop_average_salary(
+            [job for job in jobs if job.experience is not None and abs(job.experience - 1) <= 0.25],
+            17.56, 19.28
+        )
+        response = test_client.get('/average-job-salary-by-experience', query_string={"experience": 1})
+        assert response.json["jobs_num"] == count
+        assert response.json["average_salary"] == pytest.approx(average)
+
+        average, count = loop_average_salary(
+            [job for job in jobs if fuzz.token_set_ratio("python", job.title) >= 85],
+            17.66, 19.33
+        )
+        response = test_client.get('/avg-salary/python')
+        assert response.json["jobs_num"] == count
+        assert response.json["average_salary"] == pytest.approx(average)
+
+def test_skills_by_salary(test_client):
+    """Test that only skills with 10 jobs in every currency are averaged"""
+    salaries = {"usd": 1000, "mdl": 20000, "euro": 900}
+    for i in range(30):
+        currency = list(salaries)[i % 3]
+        job = Job(
+            title="Developer", salary=salaries[currency] + i, currency=currency,
+            experience=1, link=f"https://example.com/skills/{i}"
+        )
+        db.session.add(job)
+        db.session.flush()
+        db.session.add(Skill(name="python", job_id=job.id, counter=1))
+        if i < 29:
+            db.session.add(Skill(name="sql", job_id=job.id, counter=2))
+    db.session.commit()
+
+    response = test_client.get('/skills-by-salary')
+    assert response.status_code == 200
+    assert [skill["skill"] for skill in response.json] == ["python"]
+    usd_avg, mdl_avg, euro_avg = (
+        sum(salaries[c] + i for i in range(30) if i % 3 == n) / 10
+        for n, c in enumerate(salaries)
+    )
+    assert response.json[0]["jobs"] == 30
+    assert response.json[0]["avg"] == pytest.approx((euro_avg + usd_avg * 0.91 + mdl_avg * 0.052) / 3)
+
+def test_job_listings_query_count(test_client):
+    """Test that listing jobs doesn't run one query per job for its skills"""
+    add_jobs_with_skills(3, "listings-a")
+    with count_queries() as few_jobs:
+        test_client.get('/find-jobs', query_string={"title": "blockchain backend engineer"})
+        test_client.get('/get-db-data')
+
+    add_jobs_with_skills(20, "listings-b")
+    with count_queries() as many_jobs:
+        response = test_client.get('/find-jobs', query_string={"title": "blockchain backend engineer"})
+        assert len(response.json["jobs"]) == 23
+        assert all(job["skills"] == ["python", "docker", "git"] for job in response.json["jobs"])
+        response = test_client.get('/get-db-data')
+        assert response.status_code == 200
+
+    assert len(many_jobs) == len(few_jobs)
+    assert len(many_jobs) <= 6
+
+def test_get_db_data_ndjson_pages(test_client):
+    """Test the streaming export of the skills table page by page"""
+    skill_ids = [skill.id for skill in Skill.query.order_by(Skill.id)]
+
+    rows, after_id = [], 0
+    while True:
+        response = test_client.get('/get-db-data', query_string={
+            "format": "ndjson", "table": "skills", "after_id": after_id, "limit": 25
+        })
+        assert response.status_code == 200
+        page = [json.loads(line) for line in response.data.splitlines()]
+        rows += page
+        if len(page) < 25:
+            break
+        after_id = page[-1]["id"]
+
+    assert [row["id"] for row in rows] == skill_ids
+    assert set(rows[0]) == {"id", "name", "skill_id", "job_id", "counter"}
+
+    for limit in (0, -1):
+        response = test_client.get('/get-db-data', query_string={"format": "ndjson", "table": "skills", "limit": limit})
+        assert response.status_code == 400
+
+def test_insights_cached_until_new_jobs(test_client):
+    """Test that keyword insights are cached per normalized keywords until the data version changes"""
+    response = test_client.get('/generate-insight-average-experience/Data Scientist')
+    assert response.json["total_jobs"] == 0
+
+    db.session.add(Job(title="Data Scientist", experience=2, link="https://example.com/cache/1"))
+    db.session.commit()
+    response = test_client.get('/generate-insight-average-experience/scientist, DATA')
+    assert response.json["total_jobs"] == 0
+
+    bump_data_version()
+    response = test_client.get('/generate-insight-average-experience/data scientist')
+    assert response.json == {"average_experience": 2, "total_jobs": 1}
+
+def test_match_memo_shared_until_new_jobs():
+    """Test that the keyword memo is shared across calls until the index changes"""
+    index = build_index(TITLES)
+    memo = MatchMemo(index)
+    misses = MEMO_MISSES._value.get()
+    hits = MEMO_HITS._value.get()
+
+    assert memo.matching_jobs("Python Developer", 85) == index.search("python developer", 85)
+    assert memo.matching_jobs("developer, python", 85) == index.search("python developer", 85)
+    assert (MEMO_MISSES._value.get() - misses, MEMO_HITS._value.get() - hits) == (1, 1)
+
+    index.extend([(len(TITLES) + 1, "Python Developer")])
+    assert memo.matching_jobs("python developer", 85)[-1] == len(TITLES) + 1
+    assert MEMO_MISSES._value.get() - misses == 2
+
+def test_scraper_fetches_fixture_pages_concurrently(test_client):
+    """Test that concurrent scraping gives the same data as fetching one page at a time"""
+    from app.tools.rabota_md_scraper import RabotaMdScraper
+    with fixture_server() as (server, base_url):
+        scraper = RabotaMdScraper(PageFetcher(max_workers=4, rate_per_host=0), base_url=base_url)
+        links = scraper.extract_page_links(base_url + "/ro/vacancies/category/it/2")
+        assert links == [base_url + link for link in FIXTURE_LINKS]
+
+        serial = [scraper.scrape_page_data(link) for link in links]
+        assert server.max_in_flight == 1
+        concurrent = scraper.scrape_pages_data(links + [base_url + "/ro/jobs/999"])
+        assert server.max_in_flight > 1
+
+    assert concurrent == serial
+    assert [data["title"] for data in concurrent][:2] == ["Python Developer", "Senior Java Engineer"]
+    assert (concurrent[0]["salary"], concurrent[0]["currency"]) == ("2000", "euro")
+    assert [data["experience"] for data in concurrent] == [2, 5, 0, 1, 3, 2]
+
+def test_page_fetcher_backs_off_when_throttled():
+    """Test that throttled pages are retried and the concurrency limit goes down"""
+    with fixture_server(throttled=FIXTURE_LINKS) as (server, base_url):
+        fetcher = PageFetcher(max_workers=4, rate_per_host=0, backoff=0)
+        pages = fetcher.fetch_many([base_url + link for link in FIXTURE_LINKS[:3]])
+        assert all(html and "vc_detail" in html for _, html in pages)
+        assert len(server.hits) == 6
+        # Getting back to 4 takes 1 + 2 + 3 good responses after the halvings
+        assert fetcher.limit < 4
+
+def test_page_fetcher_rate_limits_per_host():
+    """Test that requests to the same host are spaced out"""
+    with fixture_server() as (server, base_url):
+        FixtureHandler.delay, delay = 0, FixtureHandler.delay
+        try:
+            fetcher = PageFetcher(max_workers=4, rate_per_host=20)
+            start = time.monotonic()
+            fetcher.fetch_many([base_url + link for link in FIXTURE_LINKS])
+            assert time.monotonic() - start >= (len(FIXTURE_LINKS) - 1) / 20
+        finally:
+            FixtureHandler.delay = delay
+
+def test_skill_matcher_counts_like_str_count(test_client):
+    """Test that the compiled matcher gives the same counts as one str.count per alias"""
+    from app.tools.rabota_md_scraper import RabotaMdScraper
+    skill_matcher.refresh()
+    skills, _ = skill_matcher._compiled
+    texts = [
+        " python python  python   python ",
+        " tcp ip tcpip tcp ip  react native react  node js node.js node ",
+        "python django c# c++ .net asp.net sql server microsoft sql server ",
+        " go golang go go  git git hub gitlab git lab ci cd r c ",
+        "  ",
+        "",
+    ]
+    with fixture_server() as (_, base_url):
+        scraper = RabotaMdScraper(PageFetcher(rate_per_host=0), base_url=base_url)
+        for data in scraper.scrape_pages_data([base_url + link for link in FIXTURE_LINKS]):
+            assert data["skills"]
+            texts.append(" ".join(data["skills"]) + " " + data["title"].lower() + " ")
+
+    for text in texts:
+        assert skill_matcher.skills_in(text) == loop_skill_counts(skills, text), text
+        assert list(skill_matcher.skills_in(text)) == list(loop_skill_counts(skills, text))
+
+    # Aliases sharing words and repeated aliases
+    skills = [["a b"], ["a"], ["b", "a b c"], ["a"], ["x  y"], [""]]
+    trie = compile_aliases(skills)
+    for text in [" a b c a b c ", " a a a ", " a b  a b c  x  y ", "a b", " a  b "]:
+        counts = count_aliases(trie, text)
+        assert counts == {
+            label: text.count(" " + label + " ")
+            for skill in skills for label in skill
+            if text.count(" " + label + " ")
+        }, text
+
+def test_skill_matcher_rebuilds_on_skills_list_changes(test_client):
+    """Test that a skill added to the list is matched without restarting"""
+    text = " zig and python "
+    assert "zig" not in skill_matcher.skills_in(text)
+
+    response = test_client.post('/add-skill-to-list', json={"skill_name": "zig"})
+    assert response.status_code == 201
+    assert skill_matcher.skills_in(text) == {"python": 1, "zig": 1}
+
+    test_client.delete(f'/delete-skill-from-list/{response.json["skill_id"]}')
+    assert skill_matcher.skills_in(text) == {"python": 1}
+
+def test_parsing_modes_extract_the_same_data(test_client):
+    """Test that lxml and partial parsing extract exactly what html.parser does"""
+    from app.tools.rabota_md_scraper import RabotaMdScraper
+    pages = {}
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            pages[name] = f.read()
+
+    def extract(scraper):
+        return [
+            scraper.parse_page_links(html) if name == "listing.html"
+            else scraper.parse_page_data(name, html)
+            for name, html in pages.items()
+        ]
+
+    expected = extract(RabotaMdScraper(parser="html.parser", partial=False))
+    assert len(expected[0]) == len(FIXTURE_LINKS)
+    for parser, partial in [("html.parser", True), ("lxml", False), ("lxml", True)]:
+        assert extract(RabotaMdScraper(parser=parser, partial=partial)) == expected, (parser, partial)
+
+def test_seen_links_skip_saved_jobs(test_client):
+    """Test that a listing page's links are checked with at most one query"""
+    seen = SeenLinks("tests:seen_links")
+    add_jobs_with_skills(2, "seen")
+    saved = [f"https://example.com/seen/{i}" for i in range(2)]
+    new = [f"https://example.com/seen/new/{i}" for i in range(20)]
+    hits, misses = SEEN_LINK_HITS._value.get(), SEEN_LINK_MISSES._value.get()
+
+    with count_queries() as queries:
+        assert seen.new_links(saved + new + new[:3]) == new
+    assert len(queries) == 1
+    assert (SEEN_LINK_HITS._value.get() - hits, SEEN_LINK_MISSES._value.get() - misses) == (0, 22)
+
+    # The saved ones are remembered, the new ones once saved
+    seen.mark_seen(new[:5])
+    with count_queries() as queries:
+        assert seen.new_links(saved + new) == new[5:]
+    assert len(queries) == 1
+    with count_queries() as queries:
+        assert seen.new_links(saved + new[:5]) == []
+    assert len(queries) == 0
+    assert SEEN_LINK_HITS._value.get() - hits == 2 + 5 + 7
+    seen.clear()
+
+def test_save_jobs_in_one_batch(test_client):
+    """Test that a page's jobs, skills and demand are saved with one insert each"""
+    data_list = [
+        {"title": "Rust Developer", "salary": "2000", "currency": "euro", "experience": 2,
+         "link": f"https://example.com/batch/{i}", "date": "12.10.2024",
+         "skills": {"rust": 3, "git": 1} if i % 2 else {}}
+        for i in range(10)
+    ]
+    with count_queries() as queries:
+        assert save_jobs(data_list) == data_list
+    assert len([q for q in queries if q.lstrip().upper().startswith("INSERT")]) == 3
+
+    jobs = Job.query.filter(Job.link.like("https://example.com/batch/%")).order_by(Job.id).all()
+    assert [job.link for job in jobs] == [data["link"] for data in data_list]
+    assert (jobs[0].salary, jobs[0].currency, jobs[0].date) == (2000, "euro", datetime.date(2024, 10, 12))
+    assert [{skill.name: skill.counter for skill in job.skills} for job in jobs] == \
+        [data["skills"] for data in data_list]
+
+def test_save_jobs_skips_bad_records(test_client):
+    """Test that a record failing to save doesn't lose the rest of the batch"""
+    data_list = [
+        {"title": "Elixir Developer", "link": "https://example.com/batch/0", "skills": {"git": 1}},
+        {"title": "Elixir Developer", "link": "https://example.com/partial/1", "skills": {"git": 1}},
+        {"title": "Elixir Developer", "link": "https://example.com/partial/1", "skills": {"git": 2}},
+        {"title": "Elixir Developer", "link": "https://example.com/partial/2", "skills": {"docker": 1}},
+    ]
+    assert save_jobs(data_list) == [data_list[1], data_list[3]]
+
+    jobs = Job.query.filter_by(title="Elixir Developer").order_by(Job.id).all()
+    assert [job.link for job in jobs] == ["https://example.com/partial/1", "https://example.com/partial/2"]
+    assert [[(skill.name, skill.counter) for skill in job.skills] for job in jobs] == \
+        [[("git", 1)], [("docker", 1)]]
+    assert Skill.query.filter(Skill.job_id.is_(None)).count() == 0
+
+def test_broadcast_dispatcher_batches_and_retries():
+    """Test that queued jobs are sent in batches and retried on server errors"""
+    jobs = [{"link": f"https://example.com/broadcast/{i}", "skills": {"python": 1}} for i in range(7)]
+    sent, dropped = BROADCAST_JOBS_SENT._value.get(), BROADCAST_JOBS_DROPPED._value.get()
+
+    with broadcast_server(failures=2) as (server, services):
+        dispatcher = BroadcastDispatcher(
+            get_services=lambda: services, batch_size=3, flush_interval=0.2, backoff=0
+        )
+        start = time.monotonic()
+        dispatcher.submit(jobs)
+        assert time.monotonic() - start < 0.1
+        dispatcher.join()
+
+    assert [path for path, _ in server.batches] == ["/broadcast-jobs-to-users/bulk"] * 3
+    assert [job for _, batch in server.batches for job in batch] == jobs
+    assert [len(batch) for _, batch in server.batches] == [3, 3, 1]
+    assert server.attempts == 5
+    assert BROADCAST_JOBS_SENT._value.get() - sent == 7
+    assert BROADCAST_JOBS_DROPPED._value.get() == dropped
+
+def test_broadcast_dispatcher_gives_up():
+    """Test that a batch is dropped after the retries, or at once on client errors"""
+    dropped = BROADCAST_JOBS_DROPPED._value.get()
+    for status, attempts in [(503, 3), (400, 1)]:
+        with broadcast_server(failures=100, status=status) as (server, services):
+            dispatcher = BroadcastDispatcher(
+                get_services=lambda: services, max_retries=2, flush_interval=0, backoff=0
+            )
+            dispatcher.submit([{"link": "https://example.com/broadcast/lost"}])
+            dispatcher.join()
+        assert server.attempts == attempts
+    assert BROADCAST_JOBS_DROPPED._value.get() - dropped == 2
+
+def test_broadcast_dispatcher_posts_each_batch_once():
+    """Test that each batch goes to one replica, the next one when it fails"""
+    jobs = [{"link": f"https://example.com/failover/{i}", "skills": {"python": 1}} for i in range(4)]
+    with broadcast_server(failures=100) as (down, down_services), \
+            broadcast_server() as (up, up_services):
+        dispatcher = BroadcastDispatcher(
+            get_services=lambda: down_services + up_services,
+            batch_size=2, flush_interval=0.2, backoff=0
+        )
+        dispatcher.submit(jobs)
+        dispatcher.join()
+        dispatcher.submit(jobs)
+        dispatcher.join()
+
+    assert [job for _, batch in up.batches for job in batch] == jobs + jobs
+    assert down.batches == []
+
+def test_crawl_queue_splits_pages_between_replicas():
+    """Test that concurrent replicas scrape each page of a run exactly once"""
+    clear_crawl_queues()
+    pages = list(range(2, 101))
+    replicas = [CrawlQueue("tests_split", poll_interval=0.01) for _ in range(3)]
+    claimed = [[] for _ in replicas]
+
+    def crawl(queue, claimed):
+        queue.start(pages)
+        for page in queue.pages():
+            claimed.append(page)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=crawl, args=args) for args in zip(replicas, claimed)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(page for pages_of in claimed for page in pages_of) == pages
+    assert all(claimed)
+    # The run is over until run_seconds have passed
+    assert not replicas[0].start(pages)
+    assert list(replicas[0].pages()) == []
+
+def test_crawl_queue_reclaims_abandoned_leases():
+    """Test that a page leased by a dead replica is scraped by another one"""
+    clear_crawl_queues()
+    reclaimed = CRAWL_LEASES_RECLAIMED._value.get()
+    dead = CrawlQueue("tests_reclaim", lease_seconds=0.2, max_attempts=2)
+    alive = CrawlQueue("tests_reclaim", lease_seconds=0.2, max_attempts=2, poll_interval=0.05)
+    assert dead.start([2, 3, 4])
+    assert dead.claim() == 2
+
+    # Waits for the lease of the page claimed by the dead replica
+    assert list(alive.pages()) == [3, 4, 2]
+    assert CRAWL_LEASES_RECLAIMED._value.get() - reclaimed == 1
+
+    # A page failing on every attempt is given up on
+    for _ in range(2):
+        redis_client.delete(alive.run_key)
+        alive.start([5])
+        assert alive.claim() == 5
+        time.sleep(0.25)
+    assert alive.claim() is None
+    assert alive.finished()
+
+def test_incremental_crawl_stops_on_known_pages(test_client, monkeypatch):
+    """Test that incremental runs stop after a streak of pages without new
+    links, and full sweeps and the shared queue's runs behave the same way
+    """
+    from app.tasks import scrape_jobs_from_rabota_md as task
+    new_links = {2: 5, 3: 0, 4: 0, 5: 1, 6: 0, 7: 0, 8: 0}
+    scraped = []
+    monkeypatch.setattr(task, "scrape_listing_page", lambda page, skip_unchanged: scraped.append(page) or new_links.get(page, 0))
+    pages = range(2, 101)
+
+    assert task.crawl(LocalCrawl(pages, full_sweep=False), 3) == (7, 92)
+    assert scraped == list(range(2, 9))
+    assert CRAWL_RUN_PAGES_SKIPPED._value.get() == 92
+    assert task.crawl(LocalCrawl(pages, full_sweep=True), 3) == (99, 0)
+    assert task.crawl(LocalCrawl(pages, full_sweep=False), 0) == (99, 0)
+
+    # The first run of the shared queue is a full sweep, the next ones not
+    clear_crawl_queues()
+    queue = CrawlQueue("tests_incremental")
+    for full_sweep, expected in [(True, (99, 0)), (False, (7, 92))]:
+        redis_client.delete(queue.run_key)
+        assert queue.start(pages, full_sweep_seconds=3600)
+        assert queue.full_sweep == full_sweep
+        assert task.crawl(queue, 3) == expected
+    assert queue.finished()
+
+def test_crawl_finishes_locally_when_the_queue_fails(test_client, monkeypatch):
+    """Test that a redis failure midway through a shared run doesn't end this replica's run"""
+    from app.tasks import scrape_jobs_from_rabota_md as task
+    scraped = []
+    monkeypatch.setattr(task, "scrape_listing_page", lambda page, skip_unchanged: scraped.append(page) or 1)
+    for failing in ("claim", "record"):
+        clear_crawl_queues()
+        queue = CrawlQueue("tests_failing")
+        # An incremental run, the last full sweep was just done
+        redis_client.set(queue.full_sweep_key, 1)
+        assert queue.start(task.PAGES, full_sweep_seconds=3600)
+        assert not queue.full_sweep
+        operation = getattr(queue, failing)
+        def fail_after_3_pages(*args):
+            if len(scraped) >= 3:
+                raise redis.ConnectionError("redis is down")
+            return operation(*args)
+        monkeypatch.setattr(queue, failing, fail_after_3_pages)
+
+        scraped.clear()
+        assert task.crawl(queue, 3) == (99, 0)
+        assert sorted(scraped) == list(task.PAGES)
+    clear_crawl_queues()
+
+def test_page_fetcher_requests_cached_pages_conditionally(test_client, tmp_path):
+    """Test that cached pages are revalidated and unchanged listings not parsed"""
+    from app.tools.rabota_md_scraper import RabotaMdScraper
+    listing = "/ro/vacancies/category/it/2"
+    not_modified, unchanged = PAGES_NOT_MODIFIED._value.get(), PAGES_UNCHANGED._value.get()
+    for validators in [True, False]:
+        cache = ResponseCache(str(tmp_path / f"cache_{validators}.db"))
+        with fixture_server(validators=validators) as (server, base_url):
+            scraper = RabotaMdScraper(PageFetcher(rate_per_host=0, cache=cache), base_url=base_url)
+            links, page = scraper.extract_listing_links(base_url + listing, skip_unchanged=True)
+            assert links == [base_url + link for link in FIXTURE_LINKS]
+            assert len(cache) == 0
+            scraper.fetcher.cache_page(page)
+            # Kept across restarts
+            scraper.fetcher.cache = ResponseCache(str(tmp_path / f"cache_{validators}.db"))
+            assert scraper.extract_listing_links(base_url + listing, skip_unchanged=True)[0] == []
+            assert scraper.extract_listing_links(base_url + listing)[0] == links
+            assert scraper.scrape_page_data(links[0])["title"] == "Python Developer"
+            # Job pages are never fetched twice, they aren't cached
+            assert len(scraper.fetcher.cache) == 1
+        assert server.conditional == ([listing] * 2 if validators else [])
+    assert PAGES_NOT_MODIFIED._value.get() - not_modified == 2
+    assert PAGES_UNCHANGED._value.get() - unchanged == 2
+
+def test_listing_cached_once_its_jobs_are_saved(test_client, tmp_path, monkeypatch):
+    """Test that a listing page whose jobs weren't all saved is parsed again next run"""
+    from app.tasks import scrape_jobs_from_rabota_md as task
+    from app.tools.rabota_md_scraper import RabotaMdScraper
+    saved_links = []
+    def save_jobs(data_list):
+        # The first job fails to save the first time
+        saved = [data for data in data_list if saved_links or data["link"] != data_list[0]["link"]]
+        saved_links.extend(data["link"] for data in saved)
+        return saved
+    monkeypatch.setattr(task, "save_jobs", save_jobs)
+    monkeypatch.setattr(task.broadcast_dispatcher, "submit", lambda saved: None)
+    def bump_data_version():
+        raise redis.ConnectionError("redis is down")
+    # The jobs are saved already, the run goes on without redis
+    monkeypatch.setattr(task, "bump_data_version", bump_data_version)
+    monkeypatch.setattr(task, "seen_links", SeenLinks("tests:listing_seen_links"))
+    task.seen_links.clear()
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    with fixture_server(validators=True) as (server, base_url):
+        monkeypatch.setattr(task, "scraper", RabotaMdScraper(PageFetcher(rate_per_host=0, cache=cache), base_url=base_url))
+        monkeypatch.setattr(task, "LISTING_URL", base_url + "/ro/vacancies/category/it/")
+        assert task.scrape_listing_page(2, skip_unchanged=True) == len(FIXTURE_LINKS)
+        assert len(cache) == 0
+        assert task.scrape_listing_page(2, skip_unchanged=True) == 1
+        assert len(cache) == 1
+        assert task.scrape_listing_page(2, skip_unchanged=True) == 0
+    assert sorted(saved_links) == sorted(base_url + link for link in FIXTURE_LINKS)
+    task.seen_links.clear()
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    """Test that the cache stays within its size, dropping the least recently used pages"""
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=300)
+    for page in range(3):
+        cache.put(f"/page/{page}", "x" * 100, etag=f'"{page}"')
+    assert cache.get("/page/0").etag == '"0"'
+    cache.put("/page/3", "y" * 100)
+    assert cache.get("/page/1") is None
+    assert [cache.get(f"/page/{page}") is not None for page in (0, 2, 3)] == [True] * 3
+    assert len(cache) == 3
+
+    cache.put("/page/0", "z" * 250)
+    assert len(ResponseCache(str(tmp_path / "cache.db"), max_bytes=300)) == 1
+
+def test_skill_demand_counted_as_jobs_are_saved(test_client):
+    """Test that the demand table backfilled by the migration and updated by
+    save_jobs gives what grouping the skill rows by name gives
+    """
+    def demand_by_grouping():
+        rows = db.session.query(Skill.name, db.func.count(Skill.name)).group_by(Skill.name)
+        return {name: count for name, count in rows if skill_matcher.skill_id(name) is not None}
+
+    def demand_by_endpoint():
+        bump_data_version()
+        with count_queries() as queries:
+            response = test_client.get("/all-skills-by-demand")
+        assert not any("GROUP BY" in query or "FROM skills " in query for query in queries)
+        demand = response.get_json()
+        assert [skill["demand"] for skill in demand] == sorted((skill["demand"] for skill in demand), reverse=True)
+        return {skill["name"]: skill["demand"] for skill in demand}
+
+    # Skill rows saved before the skill ids
+    add_jobs_with_skills(3, "demand")
+    db.session.execute(Skill.__table__.update().values(skill_id=None))
+    db.session.execute(SkillDemand.__table__.delete())
+    db.session.commit()
+    normalize_skills()
+    db.session.commit()
+    assert Skill.query.filter(Skill.name == "python", Skill.skill_id.is_(None)).count() == 0
+    assert demand_by_endpoint() == demand_by_grouping()
+
+    save_jobs([
+        {"title": "Kotlin Developer", "link": f"https://example.com/demand/new/{i}",
+         "skills": {"kotlin": 2, "python": 1, "not a listed skill": 1} if i % 2 else {"kotlin": 1}}
+        for i in range(5)
+    ])
+    expected = demand_by_grouping()
+    assert demand_by_endpoint() == expected
+    assert expected["kotlin"] >= 5
+
+def test_skill_ids_survive_skills_list_deletes(test_client):
+    """Test that jobs saved with a deleted skill aren't dropped, and that the
+    skill added back references them and counts their demand again
+    """
+    response = test_client.post('/add-skill-to-list', json={"skill_name": "nimble"})
+    skill_id = response.json["skill_id"]
+    save_jobs([{"title": "Nimble Developer", "link": "https://example.com/nimble/0", "skills": {"nimble": 1}}])
+    assert db.session.get(SkillDemand, skill_id).demand == 1
+
+    # Deleted by another replica, this one's matcher still has the id
+    db.session.delete(db.session.get(SkillsList, skill_id))
+    db.session.commit()
+    assert skill_matcher.skill_id("nimble") == skill_id
+    saved = save_jobs([{"title": "Nimble Developer", "link": "https://example.com/nimble/1", "skills": {"nimble": 2}}])
+    assert len(saved) == 1
+    assert Skill.query.filter_by(name="nimble", skill_id=skill_id).count() == 1
+    assert skill_matcher.skill_id("nimble") is None
+
+    def nimble_demand():
+        demand = test_client.get("/all-skills-by-demand").get_json()
+        return [skill["demand"] for skill in demand if skill["name"] == "nimble"]
+
+    # The endpoints changing the list invalidate the cached demand
+    assert nimble_demand() == []
+    response = test_client.post('/add-skill-to-list', json={"skill_name": "nimble"})
+    new_id = response.json["skill_id"]
+    assert Skill.query.filter_by(name="nimble", skill_id=new_id).count() == 2
+    assert db.session.get(SkillDemand, new_id).demand == 2
+    assert nimble_demand() == [2]
+    test_client.delete(f'/delete-skill-from-list/{new_id}')
+    assert nimble_demand() == []
+
+def test_typed_job_columns(test_client):
+    """Test that dates and currencies are stored typed and given back as scraped"""
+    save_jobs([
+        {"title": "Typed Developer", "link": "https://example.com/typed/0", "date": "03.11.2024",
+         "salary": "1500", "currency": "EUR", "skills": {"python": 1}},
+        {"title": "Typed Developer", "link": "https://example.com/typed/1", "date": "not a date",
+         "salary": "10", "currency": "btc"},
+    ])
+    jobs = Job.query.filter_by(title="Typed Developer").order_by(Job.id).all()
+    assert [(job.date, job.currency) for job in jobs] == [(datetime.date(2024, 11, 3), "euro"), (None, None)]
+
+    bump_data_version()
+    response = test_client.get("/find-jobs", query_string={"title": "typed developer"})
+    dates = {job["link"]: job["date"] for job in response.json["jobs"]}
+    assert [dates[job.link] for job in jobs] == ["03.11.2024", None]
+    response = test_client.get("/get-db-data", query_string={
+        "format": "ndjson", "table": "jobs", "after_id": jobs[0].id - 1, "limit": 1
+    })
+    assert json.loads(response.data)["date"] == "03.11.2024"
+
+def test_migrations_from_the_baseline_schema(test_client, tmp_path, capsys):
+    """Test that a database of the first release is migrated in place, the
+    values that don't convert kept aside
+    """
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'baseline.db'}"
+    db.init_app(app)
+    with app.app_context():
+        for statement in (
+            "CREATE TABLE jobs (id INTEGER PRIMARY KEY, title VARCHAR, salary FLOAT, currency VARCHAR, "
+            "experience FLOAT, link VARCHAR UNIQUE, date VARCHAR)",
+            "CREATE TABLE skills (id INTEGER PRIMARY KEY, name VARCHAR, job_id INTEGER REFERENCES jobs (id), counter INTEGER)",
+            "CREATE TABLE skills_list (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+        ):
+            db.session.execute(text(statement))
+        scraped = [
+            ("03.11.2024", "EUR"), (" 15.01.2024\n", "$"), ("ieri", "lei"),
+            ("31.02.2024", "btc"), (None, None), ("01.12.2023", "mdl"),
+        ]
+        db.session.execute(
+            text("INSERT INTO jobs (title, link, date, currency) VALUES ('Baseline Developer', :link, :date, :currency)"),
+            [{"link": f"https://example.com/baseline/{i}", "date": date, "currency": currency}
+             for i, (date, currency) in enumerate(scraped)]
+        )
+        db.session.execute(text("INSERT INTO skills_list (name) VALUES (:name)"),
+                           [{"name": str([name])} for name in ("python", "docker")])
+        db.session.execute(text("INSERT INTO skills (name, job_id, counter) VALUES ('python', 1, 2), ('cobol', 1, 1)"))
+        db.session.commit()
+
+        # What the service does on start
+        db.create_all()
+        migrate()
+
+        # Stored as ISO dates by sqlite
+        jobs = db.session.execute(text("SELECT date, currency FROM jobs ORDER BY id")).all()
+        assert [tuple(row) for row in jobs] == [
+            ("2024-11-03", "euro"), ("2024-01-15", "usd"), (None, "mdl"),
+            (None, None), (None, None), ("2023-12-01", "mdl"),
+        ]
+        assert Job.query.order_by(Job.id).first().date == datetime.date(2024, 11, 3)
+        assert db.session.execute(text(
+            "SELECT column_name, row_id, value FROM unconverted_values ORDER BY column_name, row_id"
+        )).all() == [("currency", 4, "btc"), ("date", 3, "ieri"), ("date", 4, "31.02.2024")]
+        assert "2 jobs.date values could not be converted" in capsys.readouterr().out
+
+        assert [(skill.name, skill.skill_id) for skill in Skill.query.order_by(Skill.id)] == [("python", 1), ("cobol", None)]
+        assert db.session.get(SkillDemand, 1).demand == 1
+        assert list(db.session.scalars(db.select(SchemaMigration.version))) == [1, 2, 3]
+        db.session.remove()
+    skill_matcher.invalidate()
+
+def test_indexes_serve_the_endpoints(test_client):
+    """Test that the endpoints read the skills through their indexes
+    instead of scanning the skills table
+    """
+    add_jobs_with_skills(30, "plans")
+    save_jobs([
+        {"title": "Haskell Compiler Engineer", "link": f"https://example.com/plans/haskell/{i}",
+         "skills": {"git": 1, "linux": 2}}
+        for i in range(2)
+    ])
+    bump_data_version()
+
+    for path, index in [
+        ("/find-jobs?title=haskell compiler engineer", "ix_skills_job_id"),
+        ("/generate-insight-skills-by-demand/haskell compiler engineer", "ix_skills_job_id"),
+        ("/skills-by-salary", "ix_skills_name"),
+    ]:
+        with query_plans() as plans:
+            assert test_client.get(path).status_code == 200
+        skills_plans = [plan for statement, plan in plans if "FROM skills" in statement]
+        assert skills_plans and all(index in plan for plan in skills_plans), (path, skills_plans)
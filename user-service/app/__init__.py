@@ -12,15 +12,20 @@ from prometheus_flask_exporter import PrometheusMetrics, NO_PREFIX
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///user.db")
+# "gevent" in production, run.py patches the standard library for it
+ASYNC_MODE = os.getenv("ASYNC_MODE", "threading")
 
 db = SQLAlchemy()
-socketio = SocketIO(cors_allowed_origins="*")
-redis_client = redis.StrictRedis(
+socketio = SocketIO(cors_allowed_origins="*", async_mode=ASYNC_MODE)
+redis_client = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
     host=os.getenv("REDIS_HOST", "localhost"),  # Redis server hostname or IP address
     port=6379,         # Redis server port
     db=0,              # Database number (default is 0)
-    decode_responses=True  # Decodes responses to strings (instead of bytes)
-)
+    decode_responses=True,  # Decodes responses to strings (instead of bytes)
+    # Bounded, the connections' greenlets wait for a free one
+    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+    timeout=20
+))
 
 
 def create_app():
@@ -35,6 +40,10 @@ def create_app():
     socketio.init_app(app)
     from . import websocket
 
+    # Emit the broadcasts other replicas route to this one's sessions
+    from .tools.node_router import start_listener
+    start_listener()
+
     # scraped real-estate data
     app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
     db.init_app(app)
@@ -3,12 +3,13 @@ import traceback
 import time
 import json
 
-from .. import socketio, redis_client
-from ..models import User, Subscription
+from ..tools.node_router import sessions_by_node, emit_to_sessions
+from ..tools.room_index import room_index
 
 
 broadcast = Blueprint("broadcast", __name__)
 REQUEST_TIMEOUT = 10
+SID_CHUNK_SIZE = 1000
 
 @broadcast.before_request
 def start_timer():
@@ -26,6 +27,23 @@ def check_timeout(response):
     return response
 
 
+def notify_subscribers(job):
+    """Send a job to the users subscribed to any of its skills, once each"""
+    rooms = list(job.get('skills', {}))
+    if not rooms:
+        return []
+
+    # The distinct subscribers of all the rooms at once
+    user_ids = room_index.users_in(rooms)
+
+    # Their socket sessions in one round trip per chunk, and one emit to
+    # the connected ones of each replica, which encodes the message once
+    for start in range(0, len(user_ids), SID_CHUNK_SIZE):
+        chunk = user_ids[start:start + SID_CHUNK_SIZE]
+        emit_to_sessions('new_job', job, sessions_by_node(chunk))
+    return user_ids
+
+
 @broadcast.route('/broadcast-jobs-to-users', methods=['POST'])
 def broadcast_jobs_to_users():
     try:
@@ -39,19 +57,30 @@ def broadcast_jobs_to_users():
         # for room in rooms:
         #     socketio.emit('new_job', data, to=room)
 
-        notified_users = set()
-        for room in rooms:
-            users_in_room = User.query\
-                .join(Subscription)\
-                .filter(Subscription.room_name == room)\
-                .all()
-            for user in users_in_room:
-                if user.id not in notified_users:
-                    user_sid = redis_client.get("sid:user:"+str(user.id))
-                    socketio.emit('new_job', data, to=user_sid)
-                    notified_users.add(user.id)
+        notify_subscribers(data)
 
         return jsonify({"msg": f"Message broadcasted to rooms: {rooms}"}), 200
+    except Exception as e:
+        print(str(e))
+        traceback.print_exc()
+        return jsonify({"err": str(e)}), 500
+
+
+@broadcast.route('/broadcast-jobs-to-users/bulk', methods=['POST'])
+def broadcast_jobs_to_users_bulk():
+    """Broadcast a list of jobs, the ones without skills are skipped"""
+    try:
+        jobs = request.json
+        if not isinstance(jobs, list):
+            return jsonify({"msg": "A list of jobs is required"}), 400
+
+        broadcasted = 0
+        for job in jobs:
+            if isinstance(job, dict) and job.get('skills'):
+                notify_subscribers(job)
+                broadcasted += 1
+
+        return jsonify({"msg": f"{broadcasted} jobs broadcasted", "jobs": broadcasted}), 200
     except Exception as e:
         print(str(e))
         traceback.print_exc()
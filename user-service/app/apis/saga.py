@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 
 from ..models import Subscription
 from .. import db
+from ..tools.room_index import room_index
 
 
 saga = Blueprint("saga", __name__)
@@ -19,6 +20,7 @@ def add_new_subscription_skill():
         db.session.flush()
         subscription_id = subscription.id
         db.session.commit()
+        room_index.add(subscription.user_id, subscription.room_name)
 
         return jsonify({"subscription_id": subscription_id}), 201
     except:
@@ -33,4 +35,11 @@ def delete_new_subscription_skill(subscription_id):
     db.session.delete(subscription)
     db.session.commit()
 
+    # The user may still be subscribed to the room through another row
+    if not Subscription.query.filter_by(
+        user_id=subscription.user_id,
+        room_name=subscription.room_name
+    ).first():
+        room_index.remove(subscription.user_id, subscription.room_name)
+
     return jsonify({"msg": "Transaction undone successfully!"}), 200
\ No newline at end of file
@@ -1,4 +1,5 @@
-from flask import request, jsonify, Blueprint
+from flask import Response, request, jsonify, Blueprint, stream_with_context
+from sqlalchemy import select
 from werkzeug.security import generate_password_hash, check_password_hash
 import time
 import json 
@@ -15,6 +16,11 @@ load_dotenv()
 USER_SERVICE_ADDRESS = os.getenv("USER_SERVICE_ADDRESS")
 USER_SERVICE_ADDRESS = USER_SERVICE_ADDRESS.replace("http://", "ws://")
 USER_SERVICE_PORT = os.getenv("SOCKET_PORT")
+EXPORT_PAGE_SIZE, EXPORT_MAX_PAGE_SIZE = 1000, 10000
+EXPORT_TABLES = {
+    "users": User,
+    "subscriptions": Subscription,
+}
 
 @user.before_request
 def start_timer():
@@ -32,6 +38,19 @@ def check_timeout(response):
     return response
 
 
+def export_rows(model, since, after_id, limit):
+    """NDJSON lines of the table rows after an id, read with a server-side cursor"""
+    result = db.session.execute(
+        select(*model.__table__.columns)
+        .where(model.id > max(since, after_id))
+        .order_by(model.id)
+        .limit(limit)
+        .execution_options(yield_per=500)
+    )
+    for row in result:
+        yield json.dumps(dict(row._mapping)) + "\n"
+
+
 @user.route('/sign-up', methods=['POST'])
 def sign_up():
     data = request.json
@@ -99,6 +118,22 @@ def status():
 
 @user.route('/get-db-data', methods=['GET'])
 def get_db_data():
+    # Streaming mode: one table page by page, keyed by id, optionally only
+    # the rows changed since a watermark
+    if request.args.get('format') == 'ndjson':
+        model = EXPORT_TABLES.get(request.args.get('table', 'users'))
+        if model is None:
+            return jsonify({'status': 'error', 'message': 'Unknown table'}), 400
+        since = request.args.get('since', 0, type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = min(request.args.get('limit', EXPORT_PAGE_SIZE, type=int), EXPORT_MAX_PAGE_SIZE)
+        if limit < 1:
+            return jsonify({'status': 'error', 'message': 'The limit must be at least 1'}), 400
+        return Response(
+            stream_with_context(export_rows(model, since, after_id, limit)),
+            mimetype='application/x-ndjson'
+        )
+
     try:
         # Query all users and their subscriptions
         users = User.query.all()
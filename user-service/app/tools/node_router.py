@@ -0,0 +1,87 @@
+from collections import defaultdict
+import json
+import os
+import socket
+import time
+import uuid
+import redis
+
+from .. import socketio, redis_client
+
+
+# The replica this process is, the owner of the sessions connected to it
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+
+def node_channel(node):
+    return "socketio:node:" + node
+
+
+# Deletes the user's session mappings only if they are still the given
+# session's, a newer one registered since keeps its routing
+UNREGISTER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1], KEYS[2])
+end
+return 0
+"""
+unregister_script = redis_client.register_script(UNREGISTER_SCRIPT)
+
+
+def register_session(user_id, sid):
+    pipeline = redis_client.pipeline()
+    pipeline.set("sid:user:"+str(user_id), sid)
+    pipeline.set("sid:node:"+str(user_id), NODE_ID)
+    pipeline.execute()
+
+
+def unregister_session(user_id, sid):
+    unregister_script(keys=["sid:user:"+str(user_id), "sid:node:"+str(user_id)], args=[sid])
+
+
+def sessions_by_node(user_ids):
+    """The connected users' session ids grouped by the replica owning them"""
+    keys = ["sid:user:"+str(user_id) for user_id in user_ids]
+    keys += ["sid:node:"+str(user_id) for user_id in user_ids]
+    values = redis_client.mget(keys)
+
+    sessions = defaultdict(list)
+    for sid, node in zip(values[:len(user_ids)], values[len(user_ids):]):
+        if sid:
+            # Sessions registered before the nodes were recorded are local
+            sessions[node or NODE_ID].append(sid)
+    return sessions
+
+
+def emit_to_sessions(event, data, sessions):
+    """Emit to the sessions of each replica, directly for this one and
+    through the owner's redis channel for the others.
+    """
+    for node, sids in sessions.items():
+        if node == NODE_ID:
+            socketio.emit(event, data, to=sids)
+            continue
+        message = json.dumps({"event": event, "data": data, "sids": sids})
+        if not redis_client.publish(node_channel(node), message):
+            print(f"Node {node} is gone, {len(sids)} sessions not reached")
+
+
+def listen():
+    """Emit the messages routed to this replica by the others"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(node_channel(NODE_ID))
+            for message in pubsub.listen():
+                try:
+                    routed = json.loads(message["data"])
+                    socketio.emit(routed["event"], routed["data"], to=routed["sids"])
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Bad routed message: {e}")
+        except redis.RedisError as e:
+            print(f"Node channel listener failed, resubscribing: {e}")
+            time.sleep(1)
+
+
+def start_listener():
+    socketio.start_background_task(listen)
@@ -0,0 +1,100 @@
+from sqlalchemy import select
+import redis
+import time
+
+from .. import db, redis_client
+from ..models import Subscription
+
+
+READY_KEY = "rooms:index_ready"
+REBUILD_LOCK_KEY = "rooms:index_rebuild"
+WRITES_KEY = "rooms:index_writes"
+
+
+def room_key(room):
+    return "room:users:" + room
+
+
+def user_key(user_id):
+    return "user:rooms:" + str(user_id)
+
+
+class RoomIndex:
+    """Room to user ids and user to rooms sets of the subscriptions in redis.
+
+    Written through by every change to the subscriptions, and rebuilt
+    from the database when the ready marker is missing, e.g. on a new or
+    flushed redis, so the broadcast and connect paths need no query.
+    Every write bumps a counter the rebuild watches, a rebuild that raced
+    a write is thrown away and done again.
+    """
+
+    def ensure(self):
+        # One replica rebuilds, the others wait for the marker
+        while not redis_client.exists(READY_KEY):
+            if redis_client.set(REBUILD_LOCK_KEY, 1, nx=True, ex=60):
+                try:
+                    self.rebuild()
+                finally:
+                    redis_client.delete(REBUILD_LOCK_KEY)
+            else:
+                time.sleep(0.05)
+
+    def rebuild(self):
+        """Replace the sets by the subscriptions in the database, False if
+        a write came in meanwhile and nothing was replaced.
+        """
+        with redis_client.pipeline() as pipeline:
+            pipeline.watch(WRITES_KEY)
+            rows = db.session.execute(
+                select(Subscription.user_id, Subscription.room_name)
+                .execution_options(yield_per=1000)
+            ).all()
+            keys = [
+                key
+                for pattern in ("room:users:*", "user:rooms:*")
+                for key in redis_client.scan_iter(pattern)
+            ]
+            pipeline.multi()
+            if keys:
+                pipeline.delete(*keys)
+            for user_id, room in rows:
+                pipeline.sadd(room_key(room), user_id)
+                pipeline.sadd(user_key(user_id), room)
+            pipeline.set(READY_KEY, 1)
+            try:
+                pipeline.execute()
+            except redis.WatchError:
+                return False
+        return True
+
+    def invalidate(self):
+        redis_client.delete(READY_KEY)
+
+    def add(self, user_id, room):
+        pipeline = redis_client.pipeline()
+        pipeline.sadd(room_key(room), user_id)
+        pipeline.sadd(user_key(user_id), room)
+        pipeline.incr(WRITES_KEY)
+        pipeline.execute()
+
+    def remove(self, user_id, room):
+        pipeline = redis_client.pipeline()
+        pipeline.srem(room_key(room), user_id)
+        pipeline.srem(user_key(user_id), room)
+        pipeline.incr(WRITES_KEY)
+        pipeline.execute()
+
+    def users_in(self, rooms):
+        """Ids of the users subscribed to any of the rooms, in order"""
+        if not rooms:
+            return []
+        self.ensure()
+        return sorted(int(user_id) for user_id in redis_client.sunion([room_key(room) for room in rooms]))
+
+    def rooms_of(self, user_id):
+        self.ensure()
+        return sorted(redis_client.smembers(user_key(user_id)))
+
+
+room_index = RoomIndex()
@@ -2,7 +2,9 @@ from flask import request
 from flask_socketio import join_room, send, emit
 
 from .models import Subscription, User
-from . import socketio, db, redis_client
+from . import socketio, db
+from .tools.node_router import register_session, unregister_session
+from .tools.room_index import room_index
 
 
 @socketio.on('connect')
@@ -12,15 +14,15 @@ def handle_connect():
     print(type(user_id))
     if not user_id: return
 
-    # Save session to redis
-    redis_client.set("sid:user:"+user_id, request.sid)
+    # Save session to redis, with the replica owning it
+    register_session(user_id, request.sid)
 
-    # Query the database to get the rooms the user is associated with
-    user_rooms = Subscription.query.filter_by(user_id=user_id).all()
+    # Get the rooms the user is associated with from the index
+    user_rooms = room_index.rooms_of(user_id)
 
     # Register the user in their rooms
     for user_room in user_rooms:
-        join_room(user_room.room_name)
+        join_room(user_room)
 
     # Send a confirmation back to the user
     send('User connected and joined rooms')
@@ -29,7 +31,7 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     user_id = request.args.get('user_id')
-    redis_client.delete("sid:user:"+user_id)
+    unregister_session(user_id, request.sid)
     # Optionally, you can handle leaving rooms or cleaning up on disconnect
     send(f'User {user_id} disconnected.')
 
@@ -70,6 +72,7 @@ def handle_subscribe(data):
     new_subscription = Subscription(room_name=tag, user=user)
     db.session.add(new_subscription)
     db.session.commit()
+    room_index.add(user.id, tag)
 
     # Join the room for WebSocket
     join_room(tag)
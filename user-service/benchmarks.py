@@ -0,0 +1,103 @@
+"""Benchmarks for the user service hot paths.
+
+Run from the user-service directory against the configured redis, e.g.:
+    python benchmarks.py broadcast --subscribers 100 1000 10000
+"""
+import argparse
+import random
+import time
+from flask import Flask
+from sqlalchemy import insert
+
+from app import db, socketio, redis_client
+from app.models import User, Subscription
+from app.apis.broadcast import notify_subscribers
+
+
+ROOMS = [
+    "python", "java", "javascript", "sql", "docker", "git", "linux", "react",
+    "english", "aws", "c#", ".net", "php", "html", "css", "agile", "jira",
+    "kubernetes", "typescript", "go",
+]
+
+
+def bench_app(subscribers, rooms_per_user=3, seed=0):
+    """In-memory database of subscribers, all of them connected"""
+    rnd = random.Random(seed)
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    socketio.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [
+            {"id": i, "username": f"bench{i}", "email": f"bench{i}@example.com", "password": f"hash{i}"}
+            for i in range(1, subscribers + 1)
+        ])
+        db.session.execute(insert(Subscription), [
+            {"user_id": i, "room_name": room}
+            for i in range(1, subscribers + 1)
+            for room in rnd.sample(ROOMS, rooms_per_user)
+        ])
+        db.session.commit()
+    pipeline = redis_client.pipeline()
+    for i in range(1, subscribers + 1):
+        pipeline.set(f"sid:user:{i}", f"bench-sid-{i}")
+    pipeline.execute()
+    return app
+
+
+def per_room_notify(job):
+    """The broadcast as it used to be, one query per room and redis GET per user"""
+    notified_users = set()
+    for room in job.get('skills', {}):
+        users_in_room = User.query\
+            .join(Subscription)\
+            .filter(Subscription.room_name == room)\
+            .all()
+        for user in users_in_room:
+            if user.id not in notified_users:
+                user_sid = redis_client.get("sid:user:"+str(user.id))
+                socketio.emit('new_job', job, to=user_sid)
+                notified_users.add(user.id)
+    return notified_users
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def bench_broadcast(args):
+    job = {
+        "title": "Senior Python Developer",
+        "skills": {room: 1 for room in ROOMS[:args.skills]},
+    }
+    for subscribers in args.subscribers:
+        app = bench_app(subscribers)
+        with app.app_context():
+            expected, per_room = timed(lambda: per_room_notify(job), args.repeat)
+            db.session.expunge_all()
+            notified, batched = timed(lambda: notify_subscribers(job), args.repeat)
+            assert set(notified) == expected
+
+        print(f"{subscribers:>8} subscribers, {len(notified):>8} notified: "
+              f"per room {per_room * 1000:9.1f}ms  batched {batched * 1000:8.1f}ms")
+        redis_client.delete(*[f"sid:user:{i}" for i in range(1, subscribers + 1)])
+
+
+BENCHMARKS = {
+    "broadcast": bench_broadcast,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1000, 10_000])
+    parser.add_argument("--skills", type=int, default=15, help="skills of the broadcasted job")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
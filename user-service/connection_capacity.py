@@ -0,0 +1,105 @@
+"""Connection capacity benchmark of one user service replica.
+
+Holds N concurrent Socket.IO websocket connections open against a running
+replica, answering its pings like a browser would, and reports how many got
+connected, how fast, and how many were still alive after the hold time.
+
+Start the replica in the production mode, then e.g.:
+    ASYNC_MODE=gevent python run.py
+    python connection_capacity.py http://localhost:8080 --connections 1000 5000 10000
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import time
+import gevent
+from gevent.pool import Pool
+import simple_websocket
+
+
+USER_ID_OFFSET = 10_000_000  # keeps the benchmark sessions apart from real users
+
+
+class Subscriber:
+    """A websocket client speaking just enough Engine.IO 4 to stay connected"""
+
+    def __init__(self, url, user_id):
+        self.url = url.replace("http", "ws", 1) + f"/socket.io/?EIO=4&transport=websocket&user_id={user_id}"
+        self.connect_time = None
+        self.error = None
+        self.alive = False
+        self.ws = None
+
+    def run(self, hold):
+        start = time.perf_counter()
+        try:
+            self.ws = simple_websocket.Client(self.url)
+            if not self.ws.receive(timeout=30).startswith("0"):  # engine.io open
+                raise Exception("no open packet")
+            self.ws.send("40")  # socket.io connect to the default namespace
+            while not (self.ws.receive(timeout=30) or "").startswith("40"):
+                pass
+            self.connect_time = time.perf_counter() - start
+            self.alive = True
+
+            deadline = time.monotonic() + hold
+            while time.monotonic() < deadline:
+                packet = self.ws.receive(timeout=max(0.1, deadline - time.monotonic()))
+                if packet == "2":  # ping
+                    self.ws.send("3")
+        except Exception as e:
+            self.error = repr(e)
+            self.alive = False
+
+    def close(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+
+def measure(url, connections, rate, hold):
+    subscribers = [Subscriber(url, USER_ID_OFFSET + i) for i in range(connections)]
+    pool = Pool(connections)
+    start = time.perf_counter()
+    for i, subscriber in enumerate(subscribers):
+        pool.spawn(subscriber.run, hold)
+        if rate and (i + 1) % rate == 0:
+            gevent.sleep(1)
+    pool.join()
+    elapsed = time.perf_counter() - start
+
+    connected = [s.connect_time for s in subscribers if s.connect_time is not None]
+    alive = sum(s.alive for s in subscribers)
+    errors = {}
+    for s in subscribers:
+        if s.error:
+            errors[s.error[:60]] = errors.get(s.error[:60], 0) + 1
+    for subscriber in subscribers:
+        subscriber.close()
+
+    print(f"{connections:>7} connections: connected {len(connected):>7}  alive after {hold}s {alive:>7}  "
+          f"connect p50 {percentile(connected, 0.5) * 1000:7.1f}ms  p99 {percentile(connected, 0.99) * 1000:7.1f}ms  "
+          f"total {elapsed:6.1f}s")
+    for error, count in sorted(errors.items(), key=lambda item: -item[1])[:3]:
+        print(f"          {count} x {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", help="base url of the replica, e.g. http://localhost:8080")
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--rate", type=int, default=500, help="connections opened per second")
+    parser.add_argument("--hold", type=float, default=60,
+                        help="seconds to keep them open, past a ping interval (25s) by default")
+    args = parser.parse_args()
+    for connections in args.connections:
+        measure(args.url, connections, args.rate, args.hold)
+        gevent.sleep(2)  # let the replica clean the sessions up
@@ -1,10 +1,24 @@
-from app import create_app, socketio
 import os
 
+# The gevent worker needs the standard library and the postgres driver
+# patched to be cooperative before anything else imports them
+ASYNC_MODE = os.getenv("ASYNC_MODE", "threading")
+if ASYNC_MODE == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+from app import create_app, socketio
+
 
 app = create_app()
 
 if __name__ == '__main__':
     # server_port = os.environ.get('PORT', '8080')
     # app.run(port=server_port, host='0.0.0.0', debug=True)
-    socketio.run(app, host='0.0.0.0', port=8080, debug=False, allow_unsafe_werkzeug=True )
\ No newline at end of file
+    if ASYNC_MODE == "gevent":
+        # gevent's WSGI server, a greenlet per connection
+        socketio.run(app, host='0.0.0.0', port=8080, debug=False)
+    else:
+        socketio.run(app, host='0.0.0.0', port=8080, debug=False, allow_unsafe_werkzeug=True )
\ No newline at end of file
@@ -1,6 +1,12 @@
 import pytest
+import json
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
 from app.models import User, Subscription
-from app import db, create_app
+from app import db, create_app, redis_client, socketio
+from app.tools.node_router import NODE_ID, node_channel
+from app.tools.room_index import room_index
 
 
 # Helper function to create a test user
@@ -11,6 +17,42 @@ def create_test_user(client, name, email, password):
         "password": password
     })
 
+# Helper function adding users subscribed to rooms, with a socket session each
+def add_subscribers(prefix, rooms_by_user):
+    users = []
+    for i, rooms in enumerate(rooms_by_user):
+        user = User(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password=f"{prefix}-hash-{i}")
+        db.session.add(user)
+        db.session.flush()
+        for room in rooms:
+            db.session.add(Subscription(room_name=room, user_id=user.id))
+        users.append(user)
+    db.session.commit()
+    # Added behind the index's back, it gets rebuilt
+    room_index.invalidate()
+    for user in users:
+        redis_client.set(f"sid:user:{user.id}", f"sid-{user.username}")
+    return users
+
+# Helper context manager counting the SQL statements sent to the database
+@contextmanager
+def count_queries():
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+# Helper fixture recording the socket messages instead of sending them
+@pytest.fixture
+def emitted(monkeypatch):
+    messages = []
+    monkeypatch.setattr(socketio, "emit", lambda event, data, to=None: messages.append((event, data, to)))
+    return messages
+
 @pytest.fixture(scope='module')
 def test_client():
     # Setup: Create a new app for testing
@@ -118,4 +160,188 @@ def test_get_subscriptions(test_client):
     # Fetch subscriptions for the user
     response = test_client.get(f'/get-subscriptions/{user.id}')
     assert response.status_code == 200
-    assert response.json == ["Room 1", "Room 2"]
\ No newline at end of file
+    assert response.json == ["Room 1", "Room 2"]
+
+def test_get_db_data_ndjson_pages(test_client):
+    """Test the streaming export of a table page by page"""
+    for i in range(5):
+        create_test_user(test_client, f"Export {i}", f"export{i}@example.com", f"password{i}")
+    user_ids = [user.id for user in User.query.order_by(User.id)]
+
+    rows, after_id = [], 0
+    while True:
+        response = test_client.get('/get-db-data', query_string={
+            "format": "ndjson", "table": "users", "after_id": after_id, "limit": 2
+        })
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        page = [json.loads(line) for line in response.data.splitlines()]
+        rows += page
+        if len(page) < 2:
+            break
+        after_id = page[-1]["id"]
+
+    assert [row["id"] for row in rows] == user_ids
+    assert set(rows[0]) == {"id", "username", "email", "password"}
+
+def test_get_db_data_ndjson_unknown_table(test_client):
+    """Test the streaming export with a table that isn't exported"""
+    response = test_client.get('/get-db-data', query_string={"format": "ndjson", "table": "secrets"})
+    assert response.status_code == 400
+
+def test_get_db_data_ndjson_rejects_empty_pages(test_client):
+    """Test the streaming export with a limit that would never advance"""
+    for limit in (0, -1):
+        response = test_client.get('/get-db-data', query_string={"format": "ndjson", "table": "users", "limit": limit})
+        assert response.status_code == 400
+
+def test_get_db_data_ndjson_since(test_client):
+    """Test that the streaming export only returns rows newer than the watermark"""
+    watermark = max(user.id for user in User.query.all())
+    response = test_client.get('/get-db-data', query_string={
+        "format": "ndjson", "table": "users", "since": watermark
+    })
+    assert response.data == b""
+
+    create_test_user(test_client, "Late User", "late@example.com", "password-late")
+    response = test_client.get('/get-db-data', query_string={
+        "format": "ndjson", "table": "users", "since": watermark
+    })
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [row["email"] for row in rows] == ["late@example.com"]
+
+def test_broadcast_jobs_bulk(test_client, emitted):
+    """Test broadcasting a list of jobs to the subscribers of their skills"""
+    add_subscribers("bulk", [["elixir"], ["elixir", "erlang"], ["haskell"]])
+    jobs = [
+        {"title": "Elixir Developer", "skills": {"elixir": 2, "erlang": 1}},
+        {"title": "Accountant", "skills": {}},
+        {"title": "Haskell Developer", "skills": {"haskell": 1}},
+    ]
+    response = test_client.post('/broadcast-jobs-to-users/bulk', json=jobs)
+    assert response.status_code == 200
+    assert response.json["jobs"] == 2
+    assert sorted((data["title"], sid) for _, data, to in emitted for sid in to) == [
+        ("Elixir Developer", "sid-bulk0"), ("Elixir Developer", "sid-bulk1"),
+        ("Haskell Developer", "sid-bulk2"),
+    ]
+
+    response = test_client.post('/broadcast-jobs-to-users/bulk', json=jobs[0])
+    assert response.status_code == 400
+
+def test_broadcast_job_resolves_subscribers_at_once(test_client, emitted):
+    """Test that a job reaches each connected subscriber once, in one emit"""
+    users = add_subscribers("fanout", [["scala", "kotlin"], ["kotlin"], ["scala"], ["kotlin"], ["cobol"]])
+    redis_client.delete(f"sid:user:{users[3].id}")  # offline
+
+    response = test_client.post('/broadcast-jobs-to-users', json={
+        "title": "JVM Developer", "skills": {"scala": 2, "kotlin": 1, "groovy": 1}
+    })
+    assert response.status_code == 200
+    assert emitted == [("new_job", {"title": "JVM Developer", "skills": {"scala": 2, "kotlin": 1, "groovy": 1}},
+                        ["sid-fanout0", "sid-fanout1", "sid-fanout2"])]
+
+def test_room_index_write_through(test_client, emitted):
+    """Test that the saga endpoints keep the room index up to date and broadcasts need no SQL"""
+    users = add_subscribers("index", [["gleam"], []])
+    response = test_client.post('/add-new-subscription-skill', json={"user_id": users[1].id, "skill_name": "gleam"})
+    assert response.status_code == 201
+    test_client.post('/add-new-subscription-skill', json={"user_id": users[1].id, "skill_name": "ocaml"})
+    assert room_index.users_in(["gleam"]) == [users[0].id, users[1].id]
+    assert room_index.rooms_of(users[1].id) == ["gleam", "ocaml"]
+
+    with count_queries() as queries:
+        test_client.post('/broadcast-jobs-to-users', json={"title": "Gleam Developer", "skills": {"gleam": 1}})
+    assert queries == []
+    assert emitted[-1][2] == ["sid-index0", "sid-index1"]
+
+    test_client.delete(f'/delete-new-subscription-skill/{response.json["subscription_id"]}')
+    assert room_index.users_in(["gleam", "ocaml"]) == [users[0].id, users[1].id]
+    assert room_index.rooms_of(users[1].id) == ["ocaml"]
+
+def test_room_index_rebuilt_after_flush(test_client):
+    """Test that the room index is rebuilt from the database when redis lost it"""
+    users = add_subscribers("rebuild", [["fortran", "cobol"], ["cobol"]])
+    expected = room_index.users_in(["cobol"])
+    assert expected[-2:] == [users[0].id, users[1].id]
+
+    redis_client.flushall()
+    assert room_index.users_in(["cobol"]) == expected
+    assert room_index.rooms_of(users[0].id) == ["cobol", "fortran"]
+
+def test_room_index_rebuild_keeps_concurrent_writes(test_client, monkeypatch):
+    """Test that a subscription written through while the index is rebuilt isn't lost"""
+    users = add_subscribers("race", [["idris"], []])
+    assert room_index.users_in(["idris"]) == [users[0].id]
+    room_index.invalidate()
+    execute, subscribed = db.session.execute, []
+    def subscribe_after_read(statement, *args, **kwargs):
+        result = execute(statement, *args, **kwargs)
+        if subscribed or not str(statement).startswith("SELECT subscriptions.user_id"):
+            return result
+        # Another replica subscribes right after the rebuild read the database
+        rows = result.freeze()
+        subscribed.append(Subscription(room_name="idris", user_id=users[1].id))
+        db.session.add(subscribed[0])
+        db.session.commit()
+        room_index.add(users[1].id, "idris")
+        return rows()
+    monkeypatch.setattr(db.session, "execute", subscribe_after_read)
+
+    assert room_index.users_in(["idris"]) == [users[0].id, users[1].id]
+    assert room_index.rooms_of(users[1].id) == ["idris"]
+
+def test_connect_joins_rooms_without_sql(test_client):
+    """Test that a connecting user joins their rooms from the index"""
+    users = add_subscribers("connect", [["zig", "nim"]])
+    room_index.ensure()
+    with count_queries() as queries:
+        client = socketio.test_client(test_client.application, query_string=f"user_id={users[0].id}")
+    assert queries == []
+    sid = redis_client.get(f"sid:user:{users[0].id}")
+    assert {"zig", "nim"} <= set(socketio.server.manager.get_rooms(sid, "/"))
+    client.disconnect()
+
+def test_stale_disconnect_keeps_newer_session(test_client):
+    """Test that an old session disconnecting doesn't erase the routing of the user's new one"""
+    users = add_subscribers("reconnect", [["odin"]])
+    query_string = f"user_id={users[0].id}"
+    old = socketio.test_client(test_client.application, query_string=query_string)
+    new = socketio.test_client(test_client.application, query_string=query_string)
+    sid = redis_client.get(f"sid:user:{users[0].id}")
+
+    old.disconnect()
+    assert redis_client.get(f"sid:user:{users[0].id}") == sid
+    assert redis_client.get(f"sid:node:{users[0].id}") == NODE_ID
+    new.disconnect()
+    assert redis_client.get(f"sid:user:{users[0].id}") is None
+    assert redis_client.get(f"sid:node:{users[0].id}") is None
+
+def test_broadcast_routed_to_owning_nodes(test_client, emitted):
+    """Test that sessions of other replicas get the job through their node's channel only"""
+    users = add_subscribers("route", [["crystal"], ["crystal"], ["crystal"]])
+    redis_client.set(f"sid:node:{users[0].id}", NODE_ID)
+    redis_client.set(f"sid:node:{users[1].id}", "other-node")
+    redis_client.set(f"sid:node:{users[2].id}", "other-node")
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(node_channel("other-node"))
+
+    job = {"title": "Crystal Developer", "skills": {"crystal": 1}}
+    test_client.post('/broadcast-jobs-to-users', json=job)
+    assert emitted == [("new_job", job, ["sid-route0"])]
+    message = None
+    for _ in range(10):
+        message = message or pubsub.get_message(timeout=0.1)
+    assert json.loads(message["data"]) == {"event": "new_job", "data": job, "sids": ["sid-route1", "sid-route2"]}
+    assert pubsub.get_message(timeout=0.1) is None
+    pubsub.close()
+
+def test_node_listener_emits_routed_messages(test_client, emitted):
+    """Test that this replica emits the messages routed to its channel"""
+    message = {"event": "new_job", "data": {"title": "Nim Developer"}, "sids": ["sid-a", "sid-b"]}
+    redis_client.publish(node_channel(NODE_ID), json.dumps(message))
+    for _ in range(50):
+        if emitted:
+            break
+        time.sleep(0.02)
+    assert emitted == [("new_job", {"title": "Nim Developer"}, ["sid-a", "sid-b"])]